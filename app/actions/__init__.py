@@ -8,3 +8,6 @@ ACTIONS = {
         send_client_times.ACTION,
     )
 }
+
+# Imported after ACTIONS as the group runner looks steps up in it
+from .group import check_coverage, run_group
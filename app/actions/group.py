@@ -0,0 +1,189 @@
+import sys
+from contextlib import nullcontext, redirect_stdout
+from typing import Any, Dict, List, Optional, Tuple
+
+import systems
+from lib.ledger import Checkpoint, Ledger, Shard
+from lib.steps import GroupedOutput, Step, run_steps
+from models.config import Config
+from . import ACTIONS
+
+
+def _load(cfg: Config, action: str) -> Optional[List[Tuple[str, int, Any, dict, Any]]]:
+    # Key, position, config, action and action config of each step, or None if the group can't be run
+
+    # Make sure we have an action group
+    if action not in cfg.actions:
+        print(f"Can't find action group '{action}' in config file")
+        return None
+
+    # Load every step before running any so a bad group doesn't fail part way through
+    loaded = []
+    keys = set()
+    for index, step in enumerate(cfg.actions.get(action)):
+        if step.action not in ACTIONS:
+            print(f"  - Unable to find an action called '{step.action}'")
+            return None
+
+        # Steps are keyed by their id, or their position when they don't have one
+        key = step.id if step.id is not None else f"#{index}"
+        if key in keys:
+            raise Exception(f"More than one step in action group '{action}' has the id '{key}'")
+        keys.add(key)
+
+        action_def = ACTIONS.get(step.action)
+        loaded.append((key, index, step, action_def, action_def["model"](**step.model_dump())))
+
+    return loaded
+
+
+def _group(action: str, organization_id: Optional[str]) -> str:
+    # Ledger key of an action group. Runs for several organizations keep a ledger for each, as units such as summary
+    # recipients can be the same across organizations
+    return action if organization_id is None else f"{action}@{organization_id}"
+
+
+def run_group(
+    cfg: Config,
+    action: str,
+    vars: Dict[str, Any],
+    services: systems.Services,
+    resume: bool = False,
+    workers: Optional[int] = None,
+    shard: Optional[Shard] = None,
+    organization_id: Optional[str] = None,
+    only_changed: bool = False,
+) -> None:
+    """
+    Execute the steps of an action group
+    :param action: Name of the action group
+    :param vars: Variables passed to every step
+    :param services: Services the steps share. Left open for the caller to close
+    :param resume: Skip work an earlier run of the group completed for the same period
+    :param workers: Number of steps run at once. Defaults to steps.workers in the config
+    :param shard: Only work on the members and clients in this shard, leaving the rest to other nodes
+    :param organization_id: Organization to run the group for, when run for several. Passed to the steps as the
+                            organization_id variable, and the ledger is kept separately for each organization
+    :param only_changed: Only redo the reports whose time entries changed since they were last sent
+    """
+    loaded = _load(cfg, action)
+    if loaded is None:
+        return
+    descriptions = {key: step.description for key, _, step, _, _ in loaded}
+
+    workers = workers if workers is not None else cfg.steps.workers
+    # When steps run at once the output of each is held back and printed together once it finishes. Output already
+    # being grouped, such as when several organizations are run at once, is grouped by step as well
+    if isinstance(sys.stdout, GroupedOutput):
+        output, grouped = sys.stdout, True
+    else:
+        output, grouped = (GroupedOutput(sys.stdout) if workers > 1 else None), False
+
+    if organization_id is not None:
+        vars = {**vars, "organization_id": organization_id}
+
+    print(
+        f"Executing action group '{action}'"
+        + (f" for organization {organization_id}" if organization_id is not None else "")
+        + (f" (shard {shard})" if shard is not None else "")
+        + (" (resuming)" if resume else "")
+        + (" (only changed)" if only_changed else "")
+    )
+
+    # Completed work is recorded so a failed run can be resumed
+    ledger = Ledger(cfg.sr_data.joinpath(".state/ledger.sqlite"))
+
+    def run(step, action_def, action_cfg, checkpoint):
+        with output.capture() if output is not None else nullcontext():
+            print(f"  - Executing step: {step.description}")
+            try:
+                action_def["execute"](cfg, action_cfg, vars, checkpoint, services)
+            except Exception as e:
+                print(f"    - Step failed: {e}")
+                raise
+
+    steps = []
+    for key, index, step, action_def, action_cfg in loaded:
+        checkpoint = Checkpoint(
+            ledger,
+            _group(action, organization_id),
+            f"{index}:{step.action}",
+            resume=resume,
+            shard=shard,
+            only_changed=only_changed,
+        )
+        steps.append(
+            Step(
+                key,
+                step.depends_on,
+                lambda args=(step, action_def, action_cfg, checkpoint): run(*args),
+            )
+        )
+
+    try:
+        with redirect_stdout(output) if output is not None and not grouped else nullcontext():
+            failed = run_steps(
+                steps,
+                workers=workers,
+                on_skipped=lambda s: print(
+                    f"  - Skipping step: {descriptions[s.key]} (a step it depends on failed)"
+                ),
+            )
+    finally:
+        # Emails a failed step left queued record their units in the ledger once sent, so wait for them before
+        # closing it
+        services.drain_email()
+        ledger.close()
+
+    if len(failed) == 1:
+        raise next(iter(failed.values()))
+    if failed:
+        raise Exception(
+            f"{len(failed)} steps of action group '{action}' failed: "
+            + ", ".join(str(descriptions[k]) for k in failed)
+        )
+
+
+def check_coverage(
+    cfg: Config,
+    action: str,
+    vars: Dict[str, Any],
+    services: systems.Services,
+    organization_id: Optional[str] = None,
+) -> int:
+    """
+    Check the ledger for work a run of an action group should have done but that no run recorded, such as after
+    running the group in shards across several nodes sharing sr-data
+    :param action: Name of the action group
+    :param vars: Variables the group was run with
+    :param organization_id: Organization the group was run for, as for run_group()
+    :return: Number of units missing
+    """
+    loaded = _load(cfg, action)
+    if loaded is None:
+        return 0
+
+    if organization_id is not None:
+        vars = {**vars, "organization_id": organization_id}
+
+    print(
+        f"Checking coverage of action group '{action}'"
+        + (f" for organization {organization_id}" if organization_id is not None else "")
+    )
+
+    ledger = Ledger(cfg.sr_data.joinpath(".state/ledger.sqlite"))
+    missing = 0
+    try:
+        for key, index, step, action_def, action_cfg in loaded:
+            period, units = action_def["units"](cfg, action_cfg, vars, services)
+            completed = ledger.completed(_group(action, organization_id), f"{index}:{step.action}", period)
+            left = sorted(units - completed)
+
+            print(f"  - {step.description}: {len(units) - len(left)} of {len(units)} done")
+            for unit in left:
+                print(f"    - Missing {unit}")
+            missing += len(left)
+    finally:
+        ledger.close()
+
+    return missing
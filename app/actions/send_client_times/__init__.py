@@ -4,4 +4,5 @@ ACTION = {
     "name": "send_client_times",
     "model": models.ActionModel,
     "execute": action.execute,
+    "units": action.units,
 }
@@ -1,23 +1,21 @@
 import datetime
-import tempfile
-from typing import Dict
+import io
+from typing import Any, Dict, Set, Tuple
 
 from psycopg2 import Error
 from psycopg2.extras import NamedTupleCursor
 import systems
 from lib import emailclient
+from lib.ledger import Checkpoint
+from lib.pipeline import Pipeline, Stage
 from models.config import Config
 from reports import client_times
+from reports.dataset import fingerprint
 from .models import ActionModel
 
 
-def execute(cfg: Config, action_cfg: ActionModel, var: Dict[str, str]):
-    db = systems.database(cfg)
-    env = systems.jinja(cfg)
-    gotenberg = systems.gotenberg(cfg)
-    email_manager = systems.email(cfg)
-
-    # Apply defaults
+def _args(cfg: Config, action_cfg: ActionModel, var: Dict[str, str]) -> Dict[str, Any]:
+    # Report arguments from the variables, falling back to the action's defaults then the global ones
     args = {
         "organization_id": var.get("organization_id"),
         "template": var.get("template"),
@@ -48,10 +46,6 @@ def execute(cfg: Config, action_cfg: ActionModel, var: Dict[str, str]):
         for k, v in args.items()
     }
 
-    attachment_name = var.get("attachment_name", action_cfg.attachment_name)
-    email_logo = var.get("email_logo", action_cfg.email_logo)
-    subject = var.get("subject", action_cfg.subject)
-
     # Add resources if any passed
     resource = (
         cfg.defaults.get("resource", [])
@@ -65,84 +59,231 @@ def execute(cfg: Config, action_cfg: ActionModel, var: Dict[str, str]):
         r_path = r_split[1] if len(r_split) == 2 else r
         args["resources"][r_split[0]] = cfg.sr_data.joinpath(r_path)
 
-    # Lookup each client who has any time in this period
-    try:
-        with db.cursor(cursor_factory=NamedTupleCursor) as cursor:
-            sql = """
-                SELECT DISTINCT clients.id as client_id, clients.name as client_name
-                FROM time_entries te LEFT JOIN clients ON (te.client_id = clients.id)
-                WHERE te.organization_id = %(organization_id)s
-                    AND te.start >= %(start)s
-                    AND te.end < %(end)s
-                  """
-
-            cursor.execute(
-                sql,
-                {
-                    "organization_id": args["organization_id"],
-                    "start": args["start"].isoformat(),
-                    "end": (args["end"] + datetime.timedelta(days=1)).isoformat(),
-                },
-            )
-            records = cursor.fetchall()
+    return args
+
+
+def _clients(db, args: Dict[str, Any]):
+    # Each client who has any time in the period
+    with db.cursor(cursor_factory=NamedTupleCursor) as cursor:
+        sql = """
+            SELECT DISTINCT clients.id as client_id, clients.name as client_name
+            FROM time_entries te LEFT JOIN clients ON (te.client_id = clients.id)
+            WHERE te.organization_id = %(organization_id)s
+                AND te.start >= %(start)s
+                AND te.end < %(end)s
+              """
+
+        cursor.execute(
+            sql,
+            {
+                "organization_id": args["organization_id"],
+                "start": args["start"].isoformat(),
+                "end": (args["end"] + datetime.timedelta(days=1)).isoformat(),
+            },
+        )
+        return cursor.fetchall()
+
 
+def units(
+    cfg: Config,
+    action_cfg: ActionModel,
+    var: Dict[str, str],
+    services: systems.Services,
+) -> Tuple[str, Set[str]]:
+    """
+    Units of work a complete run of the step does, to check none were missed
+    :return: Period and the units in it
+    """
+    args = _args(cfg, action_cfg, var)
+    return (
+        Checkpoint.period(args["start"], args["end"]),
+        {
+            "{}:{}".format(r.client_id, e.email)
+            for r in _clients(services.db, args)
+            for e in action_cfg.recipients
+        },
+    )
+
+
+def execute(
+    cfg: Config,
+    action_cfg: ActionModel,
+    var: Dict[str, str],
+    checkpoint: Checkpoint,
+    services: systems.Services,
+):
+    db = services.db
+    env = services.jinja
+    converter = services.converter
+    email_manager = services.email
+    # Emails this step queues, so it waits for and reports only its own while other steps share the email manager
+    sent = emailclient.Tracker()
+
+    args = _args(cfg, action_cfg, var)
+
+    attachment_name = var.get("attachment_name", action_cfg.attachment_name)
+    email_logo = var.get("email_logo", action_cfg.email_logo)
+    subject = var.get("subject", action_cfg.subject)
+
+    try:
+        records = _clients(db, args)
     except (Exception, Error) as error:
         print("Error while connecting to PostgreSQL", error)
         return
-    finally:
-        cursor.close()
 
-    for r in records:
+    # Clients in other shards are left to the nodes running those shards
+    if checkpoint.shard is not None:
+        owned = [r for r in records if checkpoint.owns(str(r.client_id))]
+        print("    - Shard {} has {} of {} clients".format(checkpoint.shard, len(owned), len(records)))
+        records = owned
+
+    period = checkpoint.period(args["start"], args["end"])
+
+    # Read the email logo once for every email
+    logo = None
+    if email_logo:
+        try:
+            logo, _ = converter.resource_manager.load(cfg.sr_data.joinpath(email_logo))
+        except IOError:
+            pass
+
+    # Load resources once for every report
+    resources = converter.resources(args["resources"])
+
+    # Each client's report passes through a pipeline so querying, rendering, converting and sending for different
+    # clients overlap. Emails are then sent in the background
+    def aggregate(item):
+        r, recipients, units = item
+        print("    - Generating report for {}".format(r.client_name or "(No Client)"))
+        data = client_times.load(
+            db,
+            args["organization_id"],
+            r.client_id,
+            args["start"],
+            args["end"],
+            project_filter=args["project_filter"],
+            member_filter=args["member_filter"],
+            dataset=services.datasets,
+        )
+        return r, recipients, units, data
+
+    def render(item):
+        r, recipients, units, data = item
+        parts, footer = client_times.render(
+            env,
+            converter,
+            data,
+            resources,
+            template=args["template"] or "client_times",
+            footer_template=args["footer_template"] or "footer",
+        )
+        return r, recipients, units, data, parts, footer
+
+    def convert(item):
+        r, recipients, units, data, parts, footer = item
+        pdf = io.BytesIO()
+        converter.convert(parts, footer, pdf, resources=resources)
+        return r, recipients, units, data, pdf
+
+    def send(item):
+        r, recipients, units, data, pdf = item
         client_name = r.client_name or "(No Client)"
-        print("    - Generating report for {}".format(client_name))
-        with tempfile.NamedTemporaryFile() as tmp:
-            client_id = r.client_id
-
-            # Generate report
-            data = client_times.report(
-                db,
-                env,
-                gotenberg,
-                output=tmp.name,
-                client_id=client_id,
-                **{k: v for k, v in args.items() if v is not None}
-            )
 
-            # Email to each recipient
-            for e in action_cfg.recipients:
-                print("      - Sending to {}".format(e.email))
+        # Email to each recipient
+        for e in recipients:
+            print("      - Sending {} to {}".format(client_name, e.email))
 
-                email = email_manager.new()
-                email.to.append(e.email)
-                email.subject = subject.format(
-                    start=args["start"].strftime("%d/%m/%Y"),
-                    end=args["end"].strftime("%d/%m/%Y"),
-                    client_name=client_name,
-                )
-                email.template = var.get("email_template", action_cfg.email_template)
-                email.template_args = {
-                    "name": e.name,
-                    "from_name": action_cfg.from_name,
-                    "logo": "logo.png" if email_logo else None,
-                    "start": args["start"].strftime("%d/%m/%Y"),
-                    "end": args["end"].strftime("%d/%m/%Y"),
-                    "client_name": client_name,
-                    "data": data,
-                }
-                if email_logo:
-                    email.embed.append(
-                        emailclient.File(
-                            str(cfg.sr_data.joinpath(email_logo)),
-                            "logo.png",
-                            typeof=email.AttachType.IMAGE,
-                        )
+            email = email_manager.new()
+            email.to.append(e.email)
+            email.subject = subject.format(
+                start=args["start"].strftime("%d/%m/%Y"),
+                end=args["end"].strftime("%d/%m/%Y"),
+                client_name=client_name,
+            )
+            email.template = var.get("email_template", action_cfg.email_template)
+            email.template_args = {
+                "name": e.name,
+                "from_name": action_cfg.from_name,
+                "logo": "logo.png" if email_logo else None,
+                "start": args["start"].strftime("%d/%m/%Y"),
+                "end": args["end"].strftime("%d/%m/%Y"),
+                "client_name": client_name,
+                "data": data,
+            }
+            if logo is not None:
+                email.embed.append(
+                    emailclient.File(
+                        name="logo.png", typeof=email.AttachType.IMAGE, content=logo
                     )
+                )
 
-                email.attach.append(
-                    emailclient.File(
-                        tmp.name,
-                        name=attachment_name,
-                        typeof=email.AttachType.APPLICATION,
+            email.attach.append(
+                emailclient.File(
+                    name=attachment_name,
+                    typeof=email.AttachType.APPLICATION,
+                    content=pdf.getvalue(),
+                )
+            )
+            email.enqueue(
+                on_sent=lambda unit=units[e.email]: checkpoint.complete(
+                    period, unit, fingerprints.get(str(r.client_id))
+                ),
+                tracker=sent,
+            )
+
+    # Fingerprint of each client's time entries, recorded once sent so later runs can skip clients with no changes.
+    # Only worked out when skipping unchanged reports
+    fingerprints = {}
+
+    def pending():
+        for r in records:
+            # Each email to a recipient about a client is a unit of work
+            units = {e.email: "{}:{}".format(r.client_id, e.email) for e in action_cfg.recipients}
+            recipients = [
+                e for e in action_cfg.recipients if not checkpoint.done(period, units[e.email])
+            ]
+            if not recipients:
+                print("    - Skipping {}, already sent".format(r.client_name or "(No Client)"))
+                continue
+
+            if checkpoint.only_changed:
+                fingerprints[str(r.client_id)] = fingerprint(
+                    client_times.records(
+                        db,
+                        args["organization_id"],
+                        r.client_id,
+                        args["start"],
+                        args["end"],
+                        project_filter=args["project_filter"],
+                        member_filter=args["member_filter"],
+                        dataset=services.datasets,
                     )
                 )
-                email.send()
+                recipients = [
+                    e
+                    for e in recipients
+                    if checkpoint.changed(period, units[e.email], fingerprints[str(r.client_id)])
+                ]
+                if not recipients:
+                    print("    - Skipping {}, unchanged since last sent".format(r.client_name or "(No Client)"))
+                    continue
+            yield r, recipients, units
+
+    workers = action_cfg.pipeline
+    pipeline = Pipeline(
+        [
+            Stage("aggregate", aggregate, workers.aggregate),
+            Stage("render", render, workers.render),
+            Stage("convert", convert, workers.convert),
+            Stage("send", send, workers.send),
+        ]
+    )
+    for (r, _, _), stage, error in pipeline.run(pending()):
+        print("    - Failed to {} times for {}: {}".format(stage, r.client_name or "(No Client)", error))
+
+    # Wait for the emails this step queued to be sent
+    failures = sent.wait()
+    for to, error in failures:
+        print("    - Failed sending to {}: {}".format(", ".join(to), error))
+    if failures and email_manager.outbox is not None:
+        print("    - Failed emails were kept in the outbox. Run flush-outbox to send them")
@@ -18,3 +18,6 @@ class ActionModel(config.Action):
     attachment_name: str = "Report Summary.pdf"
     email_template: str = "send_client_times"
     recipients: List[Recipient]
+
+    # Workers for each stage reports pass through
+    pipeline: config.Pipeline = config.Pipeline()
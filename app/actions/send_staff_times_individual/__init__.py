@@ -4,4 +4,5 @@ ACTION = {
     "name": "send_staff_times_individual",
     "model": models.ActionModel,
     "execute": action.execute,
+    "units": action.units,
 }
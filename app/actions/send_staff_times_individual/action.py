@@ -1,24 +1,22 @@
 import datetime
-import tempfile
-from typing import Dict
+import io
+from typing import Any, Dict, Set, Tuple
 
 from psycopg2 import Error
 from psycopg2.extras import NamedTupleCursor
 
 import systems
 from lib import emailclient
+from lib.ledger import Checkpoint
+from lib.pipeline import Pipeline, Stage
 from models.config import Config
 from reports import staff_times
+from reports.dataset import fingerprint
 from .models import ActionModel
 
 
-def execute(cfg: Config, action_cfg: ActionModel, var: Dict[str, str]):
-    db = systems.database(cfg)
-    env = systems.jinja(cfg)
-    gotenberg = systems.gotenberg(cfg)
-    email_manager = systems.email(cfg)
-
-    # Apply defaults
+def _args(cfg: Config, action_cfg: ActionModel, var: Dict[str, str]) -> Dict[str, Any]:
+    # Report arguments from the variables, falling back to the action's defaults then the global ones
     args = {
         "organization_id": var.get("organization_id"),
         "template": var.get("template"),
@@ -52,16 +50,6 @@ def execute(cfg: Config, action_cfg: ActionModel, var: Dict[str, str]):
         for k, v in args.items()
     }
 
-    attachment_name = var.get("attachment_name", action_cfg.attachment_name)
-    email_logo = var.get("email_logo", action_cfg.email_logo)
-    subject = var.get("subject", action_cfg.subject)
-
-    if subject:
-        subject = subject.format(
-            start=args["start"].strftime("%d/%m/%Y"),
-            end=args["end"].strftime("%d/%m/%Y"),
-        )
-
     # Add resources if any passed
     resource = (
         cfg.defaults.get("resource", [])
@@ -75,80 +63,222 @@ def execute(cfg: Config, action_cfg: ActionModel, var: Dict[str, str]):
         r_path = r_split[1] if len(r_split) == 2 else r
         args["resources"][r_split[0]] = cfg.sr_data.joinpath(r_path)
 
-    # Lookup each staff member who has any time in this period
-    try:
-        with db.cursor(cursor_factory=NamedTupleCursor) as cursor:
-            sql = """
-                SELECT DISTINCT users.id as user_id, users.name as user_name, users.email as user_email
-                FROM users JOIN members ON (members.user_id = users.id)
-                    JOIN time_entries te ON (te.member_id = members.id)
-                WHERE te.organization_id = %(organization_id)s
-                    AND te.start >= %(start)s
-                    AND te.end < %(end)s
-                  """
-
-            cursor.execute(
-                sql,
-                {
-                    "organization_id": args["organization_id"],
-                    "start": args["start"].isoformat(),
-                    "end": (args["end"] + datetime.timedelta(days=1)).isoformat(),
-                },
-            )
-            records = cursor.fetchall()
+    return args
+
+
+def _members(db, args: Dict[str, Any]):
+    # Each staff member who has any time in the period
+    with db.cursor(cursor_factory=NamedTupleCursor) as cursor:
+        sql = """
+            SELECT DISTINCT users.id as user_id, users.name as user_name, users.email as user_email
+            FROM users JOIN members ON (members.user_id = users.id)
+                JOIN time_entries te ON (te.member_id = members.id)
+            WHERE te.organization_id = %(organization_id)s
+                AND te.start >= %(start)s
+                AND te.end < %(end)s
+              """
 
+        cursor.execute(
+            sql,
+            {
+                "organization_id": args["organization_id"],
+                "start": args["start"].isoformat(),
+                "end": (args["end"] + datetime.timedelta(days=1)).isoformat(),
+            },
+        )
+        return cursor.fetchall()
+
+
+def units(
+    cfg: Config,
+    action_cfg: ActionModel,
+    var: Dict[str, str],
+    services: systems.Services,
+) -> Tuple[str, Set[str]]:
+    """
+    Units of work a complete run of the step does, to check none were missed
+    :return: Period and the units in it
+    """
+    args = _args(cfg, action_cfg, var)
+    return (
+        Checkpoint.period(args["start"], args["end"]),
+        {str(r.user_id) for r in _members(services.db, args)},
+    )
+
+
+def execute(
+    cfg: Config,
+    action_cfg: ActionModel,
+    var: Dict[str, str],
+    checkpoint: Checkpoint,
+    services: systems.Services,
+):
+    db = services.db
+    env = services.jinja
+    converter = services.converter
+    email_manager = services.email
+    # Emails this step queues, so it waits for and reports only its own while other steps share the email manager
+    sent = emailclient.Tracker()
+
+    args = _args(cfg, action_cfg, var)
+
+    attachment_name = var.get("attachment_name", action_cfg.attachment_name)
+    email_logo = var.get("email_logo", action_cfg.email_logo)
+    subject = var.get("subject", action_cfg.subject)
+
+    if subject:
+        subject = subject.format(
+            start=args["start"].strftime("%d/%m/%Y"),
+            end=args["end"].strftime("%d/%m/%Y"),
+        )
+
+    try:
+        records = _members(db, args)
     except (Exception, Error) as error:
         print("Error while connecting to PostgreSQL", error)
         return
-    finally:
-        cursor.close()
-
-    for r in records:
-        with tempfile.NamedTemporaryFile() as tmp:
-            user_id = r.user_id
-
-            # Generate summary times
-            data = staff_times.report(
-                db,
-                env,
-                gotenberg,
-                output=tmp.name,
-                member_id_filter=user_id,
-                **{k: v for k, v in args.items() if v is not None}
+
+    # Members in other shards are left to the nodes running those shards
+    if checkpoint.shard is not None:
+        owned = [r for r in records if checkpoint.owns(str(r.user_id))]
+        print("    - Shard {} has {} of {} members".format(checkpoint.shard, len(owned), len(records)))
+        records = owned
+
+    period = checkpoint.period(args["start"], args["end"])
+
+    # Read the email logo once for every email
+    logo = None
+    if email_logo:
+        try:
+            logo, _ = converter.resource_manager.load(cfg.sr_data.joinpath(email_logo))
+        except IOError:
+            pass
+
+    # Load resources once for every report
+    resources = converter.resources(args["resources"])
+
+    # Each member's report passes through a pipeline so querying, rendering, converting and sending for different
+    # members overlap. Emails are then sent in the background
+    def aggregate(r):
+        data = staff_times.load(
+            db,
+            args["organization_id"],
+            args["start"],
+            args["end"],
+            project_filter=args["project_filter"],
+            member_filter=args["member_filter"],
+            member_id_filter=r.user_id,
+            client_filter=args["client_filter"],
+            dataset=services.datasets,
+        )
+        return r, data
+
+    def render(item):
+        r, data = item
+        parts, footer = staff_times.render(
+            env,
+            converter,
+            data,
+            resources,
+            template=args["template"],
+            footer_template=args["footer_template"] or "footer",
+        )
+        return r, data, parts, footer
+
+    def convert(item):
+        r, data, parts, footer = item
+        pdf = io.BytesIO()
+        converter.convert(parts, footer, pdf, resources=resources)
+        return r, data, pdf
+
+    def send(item):
+        r, data, pdf = item
+        unit = str(r.user_id)
+
+        # Email to recipient
+        email_address = (
+            action_cfg.force_recipient
+            if action_cfg.force_recipient is not None
+            else r.user_email
+        )
+        print("    - Sending Times for {} to {}".format(r.user_name, email_address))
+
+        email = email_manager.new()
+        email.to.append(email_address)
+        email.subject = subject
+        email.template = action_cfg.email_template
+        email.template_args = {
+            "name": r.user_name,
+            "from_name": action_cfg.from_name,
+            "logo": "logo.png" if email_logo else None,
+            "start": args["start"].strftime("%d/%m/%Y"),
+            "end": args["end"].strftime("%d/%m/%Y"),
+            "data": data,
+        }
+        if logo is not None:
+            email.embed.append(
+                emailclient.File(
+                    name="logo.png", typeof=email.AttachType.IMAGE, content=logo
+                )
             )
 
-            # Email to recipient
-            email_address = (
-                action_cfg.force_recipient
-                if action_cfg.force_recipient is not None
-                else r.user_email
+        email.attach.append(
+            emailclient.File(
+                name=attachment_name,
+                typeof=email.AttachType.APPLICATION,
+                content=pdf.getvalue(),
             )
-            print("    - Sending Times for {} to {}".format(r.user_name, email_address))
-
-            email = email_manager.new()
-            email.to.append(email_address)
-            email.subject = subject
-            email.template = action_cfg.email_template
-            email.template_args = {
-                "name": r.user_name,
-                "from_name": action_cfg.from_name,
-                "logo": "logo.png" if email_logo else None,
-                "start": args["start"].strftime("%d/%m/%Y"),
-                "end": args["end"].strftime("%d/%m/%Y"),
-                "data": data,
-            }
-            if email_logo:
-                email.embed.append(
-                    emailclient.File(
-                        str(cfg.sr_data.joinpath(email_logo)),
-                        "logo.png",
-                        typeof=email.AttachType.IMAGE,
+        )
+        email.enqueue(
+            on_sent=lambda unit=unit: checkpoint.complete(period, unit, fingerprints.get(unit)),
+            tracker=sent,
+        )
+
+    # Fingerprint of each member's time entries, recorded once sent so later runs can skip members with no changes.
+    # Only worked out when skipping unchanged reports
+    fingerprints = {}
+
+    def pending():
+        for r in records:
+            unit = str(r.user_id)
+            if checkpoint.done(period, unit):
+                print("    - Skipping {}, already sent".format(r.user_name))
+                continue
+
+            if checkpoint.only_changed:
+                fingerprints[unit] = fingerprint(
+                    staff_times.records(
+                        db,
+                        args["organization_id"],
+                        args["start"],
+                        args["end"],
+                        project_filter=args["project_filter"],
+                        member_filter=args["member_filter"],
+                        member_id_filter=r.user_id,
+                        client_filter=args["client_filter"],
+                        dataset=services.datasets,
                     )
                 )
+                if not checkpoint.changed(period, unit, fingerprints[unit]):
+                    print("    - Skipping {}, unchanged since last sent".format(r.user_name))
+                    continue
+            yield r
 
-            email.attach.append(
-                emailclient.File(
-                    tmp.name, name=attachment_name, typeof=email.AttachType.APPLICATION
-                )
-            )
-            email.send()
+    workers = action_cfg.pipeline
+    pipeline = Pipeline(
+        [
+            Stage("aggregate", aggregate, workers.aggregate),
+            Stage("render", render, workers.render),
+            Stage("convert", convert, workers.convert),
+            Stage("send", send, workers.send),
+        ]
+    )
+    for r, stage, error in pipeline.run(pending()):
+        print("    - Failed to {} times for {}: {}".format(stage, r.user_name, error))
+
+    # Wait for the emails this step queued to be sent
+    failures = sent.wait()
+    for to, error in failures:
+        print("    - Failed sending to {}: {}".format(", ".join(to), error))
+    if failures and email_manager.outbox is not None:
+        print("    - Failed emails were kept in the outbox. Run flush-outbox to send them")
@@ -13,3 +13,6 @@ class ActionModel(config.Action):
 
     # Send to force_recipient instead of the user themselves
     force_recipient: str | None = None
+
+    # Workers for each stage reports pass through
+    pipeline: config.Pipeline = config.Pipeline()
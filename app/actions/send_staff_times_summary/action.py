@@ -1,21 +1,18 @@
 import datetime
-import tempfile
-from typing import Dict
+import io
+from typing import Any, Dict, Set, Tuple
 
 import systems
 from lib import emailclient
+from lib.ledger import Checkpoint
 from models.config import Config
 from reports import staff_times
+from reports.dataset import fingerprint
 from .models import ActionModel
 
 
-def execute(cfg: Config, action_cfg: ActionModel, var: Dict[str, str]):
-    db = systems.database(cfg)
-    env = systems.jinja(cfg)
-    gotenberg = systems.gotenberg(cfg)
-    email_manager = systems.email(cfg)
-
-    # Apply defaults
+def _args(cfg: Config, action_cfg: ActionModel, var: Dict[str, str]) -> Dict[str, Any]:
+    # Report arguments from the variables, falling back to the action's defaults then the global ones
     args = {
         "organization_id": var.get("organization_id"),
         "template": var.get("template"),
@@ -48,16 +45,6 @@ def execute(cfg: Config, action_cfg: ActionModel, var: Dict[str, str]):
         for k, v in args.items()
     }
 
-    attachment_name = var.get("attachment_name", action_cfg.attachment_name)
-    email_logo = var.get("email_logo", action_cfg.email_logo)
-    subject = var.get("subject", action_cfg.subject)
-
-    if subject:
-        subject = subject.format(
-            start=args["start"].strftime("%d/%m/%Y"),
-            end=args["end"].strftime("%d/%m/%Y"),
-        )
-
     # Add resources if any passed
     resource = (
         cfg.defaults.get("resource", [])
@@ -71,44 +58,141 @@ def execute(cfg: Config, action_cfg: ActionModel, var: Dict[str, str]):
         r_path = r_split[1] if len(r_split) == 2 else r
         args["resources"][r_split[0]] = cfg.sr_data.joinpath(r_path)
 
-    with tempfile.NamedTemporaryFile() as tmp:
-        # Generate summary times
-        data = staff_times.report(
-            db,
-            env,
-            gotenberg,
-            output=tmp.name,
-            **{k: v for k, v in args.items() if v is not None}
+    return args
+
+
+def units(
+    cfg: Config,
+    action_cfg: ActionModel,
+    var: Dict[str, str],
+    services: systems.Services,
+) -> Tuple[str, Set[str]]:
+    """
+    Units of work a complete run of the step does, to check none were missed
+    :return: Period and the units in it
+    """
+    args = _args(cfg, action_cfg, var)
+    return Checkpoint.period(args["start"], args["end"]), {r.email for r in action_cfg.recipients}
+
+
+def execute(
+    cfg: Config,
+    action_cfg: ActionModel,
+    var: Dict[str, str],
+    checkpoint: Checkpoint,
+    services: systems.Services,
+):
+    db = services.db
+    env = services.jinja
+    converter = services.converter
+    email_manager = services.email
+    # Emails this step queues, so it waits for and reports only its own while other steps share the email manager
+    sent = emailclient.Tracker()
+
+    args = _args(cfg, action_cfg, var)
+
+    attachment_name = var.get("attachment_name", action_cfg.attachment_name)
+    email_logo = var.get("email_logo", action_cfg.email_logo)
+    subject = var.get("subject", action_cfg.subject)
+
+    if subject:
+        subject = subject.format(
+            start=args["start"].strftime("%d/%m/%Y"),
+            end=args["end"].strftime("%d/%m/%Y"),
         )
 
-        # Email to each recipient
-        for r in action_cfg.recipients:
-            print("    - Sending to {}".format(r.email))
-
-            email = email_manager.new()
-            email.to.append(r.email)
-            email.subject = subject
-            email.template = var.get("email_template", action_cfg.email_template)
-            email.template_args = {
-                "name": r.name,
-                "from_name": action_cfg.from_name,
-                "logo": "logo.png" if email_logo else None,
-                "start": args["start"].strftime("%d/%m/%Y"),
-                "end": args["end"].strftime("%d/%m/%Y"),
-                "data": data,
-            }
-            if email_logo:
-                email.embed.append(
-                    emailclient.File(
-                        str(cfg.sr_data.joinpath(email_logo)),
-                        "logo.png",
-                        typeof=email.AttachType.IMAGE,
-                    )
-                )
+    # When sharded, the summary is only sent by the shard its step hashes to
+    if not checkpoint.owns(checkpoint.step):
+        print("    - Skipping, the summary is sent by another shard")
+        return
+
+    # Each recipient is a unit of work. Nothing needs generating if they all have it already
+    period = checkpoint.period(args["start"], args["end"])
+    recipients = [r for r in action_cfg.recipients if not checkpoint.done(period, r.email)]
+    if not recipients:
+        print("    - Skipping, already sent to all recipients")
+        return
+
+    # Fingerprint of the time entries in the summary, recorded once sent so later runs can skip it if nothing changed.
+    # Only worked out when skipping unchanged reports
+    summary_fingerprint = None
+    if checkpoint.only_changed:
+        summary_fingerprint = fingerprint(
+            staff_times.records(
+                db,
+                args["organization_id"],
+                args["start"],
+                args["end"],
+                project_filter=args["project_filter"],
+                member_filter=args["member_filter"],
+                member_id_filter=args["member_id_filter"],
+                client_filter=args["client_filter"],
+                dataset=services.datasets,
+            )
+        )
+        recipients = [r for r in recipients if checkpoint.changed(period, r.email, summary_fingerprint)]
+        if not recipients:
+            print("    - Skipping, unchanged since last sent")
+            return
 
-            email.attach.append(
+    # Read the email logo once for every email
+    logo = None
+    if email_logo:
+        try:
+            logo, _ = converter.resource_manager.load(cfg.sr_data.joinpath(email_logo))
+        except IOError:
+            pass
+
+    # Generate summary times. Steps running at once that generate the same summary share it
+    pdf = io.BytesIO()
+    data = services.coalescer.report(
+        staff_times.report,
+        db,
+        env,
+        converter,
+        output=pdf,
+        dataset=services.datasets,
+        **{k: v for k, v in args.items() if v is not None}
+    )
+
+    # Email to each recipient. Emails are sent in the background
+    for r in recipients:
+        print("    - Sending to {}".format(r.email))
+
+        email = email_manager.new()
+        email.to.append(r.email)
+        email.subject = subject
+        email.template = var.get("email_template", action_cfg.email_template)
+        email.template_args = {
+            "name": r.name,
+            "from_name": action_cfg.from_name,
+            "logo": "logo.png" if email_logo else None,
+            "start": args["start"].strftime("%d/%m/%Y"),
+            "end": args["end"].strftime("%d/%m/%Y"),
+            "data": data,
+        }
+        if logo is not None:
+            email.embed.append(
                 emailclient.File(
-                    tmp.name, name=attachment_name, typeof=email.AttachType.APPLICATION
+                    name="logo.png", typeof=email.AttachType.IMAGE, content=logo
                 )
             )
-            email.send()
+
+        email.attach.append(
+            emailclient.File(
+                name=attachment_name,
+                typeof=email.AttachType.APPLICATION,
+                content=pdf.getvalue(),
+            )
+        )
+        email.enqueue(
+            on_sent=lambda unit=r.email: checkpoint.complete(period, unit, summary_fingerprint),
+            tracker=sent,
+        )
+
+    # Wait for the emails this step queued to be sent
+    failures = sent.wait()
+    for to, error in failures:
+        print("    - Failed sending to {}: {}".format(", ".join(to), error))
+    if failures and email_manager.outbox is not None:
+        print("    - Failed emails were kept in the outbox. Run flush-outbox to send them")
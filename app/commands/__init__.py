@@ -1,6 +1,10 @@
-from . import action, generate
+from . import action, flush_outbox, generate, generate_batch, serve, serve_scheduler
 
 COMMANDS = (
     action.cmd,
+    flush_outbox.cmd,
     generate.cmd,
+    generate_batch.cmd,
+    serve.cmd,
+    serve_scheduler.cmd,
 )
@@ -1,6 +1,8 @@
 import click
 
-from actions import ACTIONS
+import systems
+import actions
+from lib.ledger import Shard
 from models.config import Config
 
 
@@ -11,8 +13,53 @@ from models.config import Config
     help="Pass a variable to actions. Format of 'key=value'. Can be passed multiple times",
     multiple=True,
 )
+@click.option(
+    "--resume",
+    is_flag=True,
+    help="Skip the reports and emails an earlier run of this action group already completed for the same period",
+)
+@click.option(
+    "--only-changed",
+    is_flag=True,
+    help="Only regenerate and resend the reports whose time entries changed since an earlier run sent them",
+)
+@click.option(
+    "--workers",
+    type=int,
+    help="Number of steps run at once. Steps still wait for the steps in their depends_on (Default: steps.workers or 1)",
+)
+@click.option(
+    "--shard",
+    help="Only work on the members and clients in shard i of n (i/n), so several nodes can share a run",
+)
+@click.option(
+    "--organization-id",
+    help="Run the group for this organization. Can be passed multiple times to run it for each organization",
+    multiple=True,
+)
+@click.option(
+    "--all-organizations",
+    is_flag=True,
+    help="Run the group for every organization",
+)
+@click.option(
+    "--check-coverage",
+    is_flag=True,
+    help="Instead of running the group, check the ledger for work no run (or shard) of it completed",
+)
 @click.pass_context
-def cmd(ctx, action, var):
+def cmd(
+    ctx,
+    action,
+    var,
+    resume,
+    only_changed,
+    workers,
+    shard,
+    organization_id,
+    all_organizations,
+    check_coverage,
+):
     """
     Execute the action group
     """
@@ -29,21 +76,62 @@ def cmd(ctx, action, var):
 
             vars[k].append(v)
 
-    # Make sure we have an action group
-    if action not in cfg.actions:
-        print(f"Can't find action group '{action}' in config file")
-        return
+    shard = Shard.parse(shard) if shard is not None else None
 
-    print(f"Executing action group '{action}'")
+    # Steps share the database connection, templates, converter and email manager. Each is created when first used and
+    # all are closed once the group finishes.
+    with systems.Services(cfg) as services:
+        if not organization_id and not all_organizations:
+            if check_coverage:
+                if actions.check_coverage(cfg, action, vars, services):
+                    ctx.exit(1)
+                return
 
-    # For each step in the group, load the action and execute it
-    for step in cfg.actions.get(action):
-        if step.action not in ACTIONS:
-            print(f"  - Unable to find an action called '{step.action}'")
+            actions.run_group(
+                cfg,
+                action,
+                vars,
+                services,
+                resume=resume,
+                workers=workers,
+                shard=shard,
+                only_changed=only_changed,
+            )
             return
 
-        action_def = ACTIONS.get(step.action)
-        action_cfg = action_def["model"](**step.model_dump())
+        # Run for several organizations, sharing the services between them
+        organization_ids = systems.organizations(cfg, services.db, organization_id, all_organizations)
+        if not organization_ids:
+            raise Exception("No organizations to run for")
+
+        if check_coverage:
+            missing = sum(
+                actions.check_coverage(cfg, action, vars, services, organization_id=o)
+                for o in organization_ids
+            )
+            if missing:
+                ctx.exit(1)
+            return
 
-        print(f"  - Executing step: {step.description}")
-        action_def["execute"](cfg, action_cfg, vars)
+        # Each period's time entries are fetched for every organization in one query
+        services.datasets.batch(organization_ids)
+        failed = systems.for_each_organization(
+            cfg,
+            organization_ids,
+            lambda o: actions.run_group(
+                cfg,
+                action,
+                vars,
+                services,
+                resume=resume,
+                workers=workers,
+                shard=shard,
+                organization_id=o,
+                only_changed=only_changed,
+            ),
+        )
+        if failed:
+            raise Exception(
+                f"Action group '{action}' failed for {len(failed)} of {len(organization_ids)} organizations: "
+                + ", ".join(failed)
+            )
@@ -0,0 +1,39 @@
+import click
+
+import systems
+from models.config import Config
+
+
+@click.command("flush-outbox")
+@click.option(
+    "--retry-interrupted",
+    is_flag=True,
+    help="Also send emails whose delivery was cut short. These may already have been received",
+)
+@click.option("--purge", is_flag=True, help="Delete delivered emails from the outbox afterwards")
+@click.pass_context
+def cmd(ctx, retry_interrupted, purge):
+    """
+    Send emails left in the outbox by earlier actions
+    """
+
+    cfg: Config = ctx.obj["config"]
+
+    if cfg.email is None or not cfg.email.outbox:
+        print("The outbox is not enabled in the email config")
+        return
+
+    email_manager = systems.email(cfg)
+    with email_manager:
+        count, failures = email_manager.flush_outbox(retry_interrupted=retry_interrupted)
+
+    print(f"Sent {count - len(failures)} of {count} emails from the outbox")
+    for to, error in failures:
+        print("  - Failed sending to {}: {}".format(", ".join(to), error))
+
+    rejected = email_manager.outbox.rejected()
+    if rejected:
+        print(f"{len(rejected)} emails were rejected by the server and won't be retried. See outbox/ledger.jsonl")
+
+    if purge:
+        print(f"Deleted {email_manager.outbox.purge()} delivered emails")
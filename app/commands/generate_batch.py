@@ -0,0 +1,268 @@
+import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import click
+
+import systems
+from lib.config import load_config
+from lib.steps import Step, run_steps
+from models.config import Config
+from models.manifest import Manifest, ManifestReport
+from reports import client_times, staff_times
+from reports.export import FORMATS
+
+# Reports that can be generated, mapped to their report function and the filters it takes
+REPORTS: Dict[str, Tuple[Callable, Tuple[str, ...]]] = {
+    "staff_times": (
+        staff_times.report,
+        ("project_filter", "member_filter", "client_filter", "member_id_filter"),
+    ),
+    "client_times": (client_times.report, ("project_filter", "member_filter", "client_id")),
+}
+
+
+class Job(NamedTuple):
+    report: Callable
+    # Arguments to the report function
+    args: Dict[str, Any]
+
+
+def split(
+    start: datetime.date, end: datetime.date, by: Optional[str]
+) -> List[Tuple[datetime.date, datetime.date, str]]:
+    """
+    Divide a range of dates into periods
+    :param by: week (Monday to Sunday), month or None to keep the whole range. Periods at either end are cut short to
+               the range
+    :return: First day, last day and label of each period
+    """
+    if by is None:
+        return [(start, end, f"{start.isoformat()}_{end.isoformat()}")]
+    if by not in ("week", "month"):
+        raise Exception(f"Can't split by '{by}'. Use week or month")
+
+    periods = []
+    day = start
+    while day <= end:
+        if by == "week":
+            last = day + datetime.timedelta(days=6 - day.weekday())
+            year, week, _ = day.isocalendar()
+            label = f"{year}-W{week:02d}"
+        else:
+            next_month = (day.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+            last = next_month - datetime.timedelta(days=1)
+            label = day.strftime("%Y-%m")
+        periods.append((day, min(last, end), label))
+        day = last + datetime.timedelta(days=1)
+    return periods
+
+
+def jobs(cfg: Config, db, entry: ManifestReport) -> List[Job]:
+    """
+    Reports to generate for an entry of the manifest, one for each period
+    """
+    report, filters = REPORTS[entry.report]
+    if entry.format not in FORMATS:
+        raise Exception(f"Unknown format '{entry.format}' for {entry.report}. Use one of {', '.join(FORMATS)}")
+    for name in ("member_id_filter", "client_id"):
+        if getattr(entry, name) is not None and name not in filters:
+            raise Exception(f"{entry.report} can't be filtered by {name}")
+
+    # Apply defaults as generate does
+    values = {
+        k: v if v is not None else cfg.defaults.get(k)
+        for k, v in entry.model_dump(exclude={"report", "format", "split_by", "resource"}).items()
+    }
+    if values["organization_id"] is None:
+        raise Exception(f"No organization_id specified for {entry.report}")
+    start = values["start"] or datetime.date.today()
+    end = values["end"] or datetime.date.today()
+
+    # A client can be given by name as with generate
+    if entry.report == "client_times" and values["client_id"] is None and values["client_filter"] is not None:
+        values["client_id"] = client_times.find_client(db, values["client_filter"], values["organization_id"])
+        if values["client_id"] is None:
+            raise Exception(f"No client matches '{values['client_filter']}'")
+        values["client_id"] = str(values["client_id"])
+
+    resources = {}
+    for r in cfg.defaults.get("resource", []) + entry.resource:
+        r_split = r.split(":", 1)
+        r_path = r_split[1] if len(r_split) == 2 else r
+        resources[r_split[0]] = cfg.sr_data.joinpath(r_path)
+
+    output = values["output"] or f"{entry.report}-{{period}}.{entry.format}"
+    # An output set in the config's defaults takes the extension of the format being written
+    if entry.output is None and values["output"] is not None:
+        output = str(Path(output).with_suffix("." + entry.format))
+
+    result = []
+    for period_start, period_end, period in split(start, end, entry.split_by):
+        fields = {k: v if v is not None else "" for k, v in values.items()}
+        fields.update(start=period_start.isoformat(), end=period_end.isoformat(), period=period)
+        try:
+            name = output.format_map(fields)
+        except KeyError as e:
+            raise Exception(f"Unknown placeholder {e} in output '{output}'")
+
+        args = {
+            "organization_id": values["organization_id"],
+            "start": period_start,
+            "end": period_end,
+            "template": values["template"],
+            "footer_template": values["footer_template"],
+            "resources": resources,
+            "format": entry.format,
+            # Map output under sr-data
+            "output": str(cfg.sr_data.joinpath(name)),
+        }
+        args.update({k: values[k] for k in filters})
+        result.append(Job(report, {k: v for k, v in args.items() if v is not None}))
+
+    return result
+
+
+@click.command("generate-batch")
+@click.argument("report", type=click.Choice(list(REPORTS)), required=False)
+@click.option(
+    "--manifest",
+    help="YAML file listing the reports to generate. Other options are applied to every report in it that doesn't set "
+    "its own",
+)
+@click.option(
+    "--split-by",
+    help="Write a file for each week or month between start and end",
+    type=click.Choice(["week", "month"]),
+)
+@click.option(
+    "--output",
+    help="Output file. {start}, {end}, {period} and the other options are filled in for each file "
+    "(Default: <report>-{period}.<format>)",
+)
+@click.option(
+    "--format",
+    help="Output format. Formats other than pdf skip PDF conversion (Default: pdf)",
+    type=click.Choice(FORMATS),
+)
+@click.option("--organization-id", help="Organization UUID")
+@click.option("--client-id", help="Client ID for client_times. Can be passed multiple times", multiple=True)
+@click.option("--template", help="Which Template to use")
+@click.option("--footer-template", help="Which template to use for the footer")
+@click.option(
+    "--start",
+    help="Start Date (YYYY-MM-DD) (Default:today)",
+    type=click.DateTime(formats=["%Y-%m-%d"]),
+)
+@click.option(
+    "--end",
+    help="End Date (YYYY-MM-DD) (Default:today)",
+    type=click.DateTime(formats=["%Y-%m-%d"]),
+)
+@click.option("--member-id-filter", help="Filter by member id")
+@click.option("--project-filter", help="Filter by project (partial match)")
+@click.option("--member-filter", help="Filter by member (partial match)")
+@click.option("--client-filter", help="Filter by Client Name (partial match)")
+@click.option(
+    "--resource",
+    help="Add a resource readable by the template ([name:]file)",
+    multiple=True,
+)
+@click.option("--workers", type=int, help="Number of reports converted at once (Default: batch.workers or 2)")
+@click.pass_context
+def cmd(
+    ctx,
+    report,
+    manifest,
+    split_by,
+    output,
+    format,
+    organization_id,
+    client_id,
+    template,
+    footer_template,
+    start,
+    end,
+    member_id_filter,
+    project_filter,
+    member_filter,
+    client_filter,
+    resource,
+    workers,
+):
+    """
+    Generate many reports at once, fetching the time entries they need once
+    """
+
+    cfg: Config = ctx.obj["config"]
+
+    options = {
+        "split_by": split_by,
+        "output": output,
+        "format": format,
+        "organization_id": organization_id,
+        "template": template,
+        "footer_template": footer_template,
+        "start": start.date() if start is not None else None,
+        "end": end.date() if end is not None else None,
+        "member_id_filter": member_id_filter,
+        "project_filter": project_filter,
+        "member_filter": member_filter,
+        "client_filter": client_filter,
+    }
+    options = {k: v for k, v in options.items() if v is not None}
+    if resource:
+        options["resource"] = list(resource)
+
+    if manifest is not None:
+        if report is not None or client_id:
+            raise Exception("Pass either a manifest or a report, not both")
+        paths = [Path(manifest), cfg.sr_data.joinpath(manifest)]
+        if not any(p.exists() for p in paths):
+            raise Exception(f"Can't find manifest '{manifest}'")
+        loaded = load_config(paths, None, Manifest)
+        entries = [{**loaded.defaults, **options, **r} for r in loaded.reports]
+    elif report is not None:
+        entries = [{"report": report, **options, "client_id": c} for c in client_id] or [{"report": report, **options}]
+    else:
+        raise Exception("Pass a report or a manifest")
+
+    with systems.Services(cfg) as services:
+        db = services.db
+
+        batch = [job for e in entries for job in jobs(cfg, db, ManifestReport.model_validate(e))]
+        outputs = [job.args["output"] for job in batch]
+        for o in set(outputs):
+            if outputs.count(o) > 1:
+                raise Exception(f"Several reports would be written to {o}. Add {{period}} or a filter to the output")
+
+        # Fetch every organization's time entries across the whole range once, so each report is cut from the same
+        # rows rather than querying its own period
+        ranges: Dict[str, Tuple[datetime.date, datetime.date]] = {}
+        for job in batch:
+            o = job.args["organization_id"]
+            first, last = ranges.get(o, (job.args["start"], job.args["end"]))
+            ranges[o] = (min(first, job.args["start"]), max(last, job.args["end"]))
+        services.datasets.batch(list(ranges))
+        for o, (first, last) in ranges.items():
+            services.datasets.rows(db, o, first, last, {})
+
+        env = services.jinja
+        converter = services.converter
+
+        def run(job: Job) -> None:
+            print(f"Generating {job.args['output']} from {job.args['start']} to {job.args['end']}")
+            Path(job.args["output"]).parent.mkdir(parents=True, exist_ok=True)
+            if job.report(db, env, converter, dataset=services.datasets, **job.args) is None:
+                raise Exception("No report was generated")
+
+        failed = run_steps(
+            [Step(job.args["output"], [], lambda job=job: run(job)) for job in batch],
+            workers=workers if workers is not None else cfg.batch.workers,
+        )
+
+    print(f"Generated {len(batch) - len(failed)} of {len(batch)} reports")
+    for o, error in failed.items():
+        print(f"  - Failed generating {o}: {error}")
+    if failed:
+        ctx.exit(1)
@@ -0,0 +1,258 @@
+import datetime
+import hmac
+import signal
+import sys
+import uuid
+from http.server import BaseHTTPRequestHandler
+from typing import Any, Callable, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import click
+
+import systems
+from lib.server import ChunkedWriter, PooledHTTPServer
+from models.config import Config, ServeKey
+from reports import client_times, staff_times
+
+
+def _date(params: Dict[str, str], name: str) -> datetime.date:
+    if not params.get(name):
+        return datetime.date.today()
+    try:
+        return datetime.datetime.strptime(params[name], "%Y-%m-%d").date()
+    except ValueError:
+        raise ValueError(f"{name} should be a date (YYYY-MM-DD)")
+
+
+def _uuid(params: Dict[str, str], name: str) -> Optional[str]:
+    if not params.get(name):
+        return None
+    try:
+        return str(uuid.UUID(params[name]))
+    except ValueError:
+        raise ValueError(f"{name} should be a UUID")
+
+
+def _common_args(cfg: Config, params: Dict[str, str]) -> Dict[str, Any]:
+    # Arguments shared by every report, with the same defaults as generate
+    args = {
+        "organization_id": _uuid(params, "organization_id") or cfg.defaults.get("organization_id"),
+        "start": _date(params, "start"),
+        "end": _date(params, "end"),
+        "template": params.get("template"),
+        "footer_template": params.get("footer_template"),
+        "project_filter": params.get("project"),
+        "member_filter": params.get("member"),
+    }
+    if args["organization_id"] is None:
+        raise ValueError("No organization_id specified")
+
+    args["resources"] = {}
+    for r in cfg.defaults.get("resource", []):
+        r_split = r.split(":", 1)
+        r_path = r_split[1] if len(r_split) == 2 else r
+        args["resources"][r_split[0]] = cfg.sr_data.joinpath(r_path)
+
+    return args
+
+
+def staff_times_args(cfg: Config, db, params: Dict[str, str], key: Optional[ServeKey]) -> Dict[str, Any]:
+    args = _common_args(cfg, params)
+    args["client_filter"] = params.get("client")
+    args["member_id_filter"] = _uuid(params, "member_id")
+
+    # Keys limited to a member can only fetch that member's own times
+    if key is not None and key.member_id is not None:
+        if args["member_id_filter"] not in (None, key.member_id):
+            raise PermissionError("This key can only fetch its own times")
+        args["member_id_filter"] = key.member_id
+        args["template"] = args["template"] or "staff_times_individual"
+
+    return args
+
+
+def client_times_args(cfg: Config, db, params: Dict[str, str], key: Optional[ServeKey]) -> Dict[str, Any]:
+    if key is not None and key.member_id is not None:
+        raise PermissionError("This key can only fetch its own times")
+
+    args = _common_args(cfg, params)
+    args["client_id"] = _uuid(params, "client_id")
+
+    # As with generate, a client can be looked up by name instead
+    if args["client_id"] is None and params.get("client"):
+        args["client_id"] = client_times.find_client(db, params["client"])
+        if args["client_id"] is None:
+            raise ValueError(f"No client matches '{params['client']}'")
+
+    return args
+
+
+# Reports served, mapped to their report function and the function turning query parameters into its arguments
+REPORTS: Dict[str, Tuple[Callable, Callable]] = {
+    "staff_times": (staff_times.report, staff_times_args),
+    "client_times": (client_times.report, client_times_args),
+}
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    Generates a report for each GET /<report>?<parameters> and streams back the PDF
+    """
+
+    # Needed for chunked responses. Connections are still closed after each response so they don't hold a worker
+    protocol_version = "HTTP/1.1"
+    server: "ReportServer"
+
+    def log_message(self, format, *args) -> None:
+        print("{} - {}".format(self.address_string(), format % args))
+
+    def _error(self, code: int, message: str) -> None:
+        body = (message + "\n").encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _key(self) -> Optional[ServeKey]:
+        # The key the request was made with. Raises PermissionError if keys are needed and none matches
+        keys = self.server.cfg.serve.keys
+        if not keys:
+            return None
+
+        scheme, _, token = self.headers.get("Authorization", "").partition(" ")
+        if scheme.lower() == "bearer":
+            for key in keys:
+                if hmac.compare_digest(key.key.encode("utf-8"), token.strip().encode("utf-8")):
+                    return key
+        raise PermissionError("A valid key is needed")
+
+    def do_GET(self) -> None:
+        self.close_connection = True
+
+        url = urlparse(self.path)
+        name = url.path.strip("/")
+        if name not in REPORTS:
+            self._error(404, "Unknown report. Available reports: {}".format(", ".join(REPORTS)))
+            return
+        report, build_args = REPORTS[name]
+
+        cfg = self.server.cfg
+        services = self.server.services
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+
+        try:
+            key = self._key()
+        except PermissionError as e:
+            self._error(401, str(e))
+            return
+
+        try:
+            db = self.server.db()
+            args = build_args(cfg, db, params, key)
+        except ValueError as e:
+            self._error(400, str(e))
+            return
+        except PermissionError as e:
+            self._error(403, str(e))
+            return
+        except Exception as e:
+            print(f"Failed preparing {name}: {e}")
+            self._error(500, "Failed generating the report")
+            return
+
+        filename = "{}-{}-{}.pdf".format(name, args["start"].isoformat(), args["end"].isoformat())
+        output = ChunkedWriter(
+            self,
+            {
+                "Content-Type": "application/pdf",
+                "Content-Disposition": f'inline; filename="{filename}"',
+            },
+        )
+
+        try:
+            # Identical requests arriving together share one report
+            data = services.coalescer.report(
+                report,
+                db,
+                services.jinja,
+                services.converter,
+                output=output,
+                **{k: v for k, v in args.items() if v is not None},
+            )
+        except Exception as e:
+            # If the PDF was already being sent the connection is closed without finishing it so the client sees it
+            # was cut short
+            print(f"Failed generating {name}: {e}")
+            if not output.started:
+                self._error(500, "Failed generating the report")
+            return
+
+        if output.started:
+            output.close()
+        elif data is None:
+            self._error(500, "Failed generating the report")
+
+
+class ReportServer(PooledHTTPServer):
+    """
+    Serves reports using services kept warm for the life of the server
+    """
+
+    def __init__(self, cfg: Config, services: systems.Services):
+        self.cfg = cfg
+        self.services = services
+        super().__init__(
+            (cfg.serve.host, cfg.serve.port),
+            Handler,
+            workers=cfg.serve.workers,
+            backlog=cfg.serve.backlog,
+        )
+
+    def db(self):
+        """
+        The shared database connection, reconnecting if it dropped
+        """
+        db = self.services.db
+        if db.closed:
+            self.services.reset()
+            db = self.services.db
+
+        # Each query runs in its own transaction so requests always see the latest time entries and no transaction is
+        # left open between requests
+        if not db.autocommit:
+            db.autocommit = True
+        return db
+
+
+@click.command("serve")
+@click.pass_context
+def cmd(ctx):
+    """
+    Generate reports on request over HTTP
+    """
+
+    cfg: Config = ctx.obj["config"]
+
+    # Stop cleanly when the container is stopped
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    with systems.Services(cfg) as services:
+        server = ReportServer(cfg, services)
+
+        # Connect and load templates up front so the first request doesn't pay for it
+        server.db()
+        services.jinja
+        services.converter
+
+        if not cfg.serve.keys:
+            print("Warning: no keys are set under serve so anyone can generate any report")
+        print(f"Serving {', '.join(REPORTS)} on http://{cfg.serve.host}:{cfg.serve.port}")
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            print("Stopping server")
+            server.server_close()
@@ -0,0 +1,142 @@
+import datetime
+import signal
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import click
+
+import systems
+from actions import run_group
+from lib.config import load_config
+from lib.scheduler import Cron
+from models.config import Config, Schedule
+
+# Config sections the shared services are created from. The services are only replaced when one of these changes
+SERVICE_SETTINGS = {"db", "email", "renderer", "gotenberg", "cache", "chunk", "resources"}
+
+
+class Job(object):
+    """
+    A schedule and the next time it is due
+    """
+
+    def __init__(self, schedule: Schedule, now: datetime.datetime):
+        self.schedule = schedule
+        self.cron = Cron(schedule.cron)
+        self.due = self.cron.next(now)
+
+
+def dates(today: datetime.date) -> Dict[str, str]:
+    """
+    Dates relative to a day that scheduled variables can refer to
+    """
+    week_start = today - datetime.timedelta(days=today.weekday())
+    month_start = today.replace(day=1)
+    last_month_end = month_start - datetime.timedelta(days=1)
+    return {
+        "today": today.isoformat(),
+        "yesterday": (today - datetime.timedelta(days=1)).isoformat(),
+        "week_start": week_start.isoformat(),
+        "last_week_start": (week_start - datetime.timedelta(days=7)).isoformat(),
+        "last_week_end": (week_start - datetime.timedelta(days=1)).isoformat(),
+        "month_start": month_start.isoformat(),
+        "last_month_start": last_month_end.replace(day=1).isoformat(),
+        "last_month_end": last_month_end.isoformat(),
+    }
+
+
+class _Dates(dict):
+    # Leaves placeholders that aren't dates as they are
+    def __missing__(self, key: str) -> str:
+        return "{" + key + "}"
+
+
+def _mtimes(paths: List[Path]) -> List[Optional[int]]:
+    return [p.stat().st_mtime_ns if p.exists() else None for p in paths]
+
+
+def _run(cfg: Config, job: Job, services: systems.Services) -> None:
+    now = datetime.datetime.now()
+
+    print(f"[{now:%Y-%m-%d %H:%M}] Running scheduled action group '{job.schedule.action}'")
+    services.reset()
+    try:
+        vars = {k: v.format_map(_Dates(dates(now.date()))) for k, v in job.schedule.var.items()}
+        run_group(cfg, job.schedule.action, vars, services)
+    except Exception as e:
+        print(f"Action group '{job.schedule.action}' failed: {e}")
+    finally:
+        # Don't hold a transaction open on the database until the next run
+        services.reset()
+
+
+@click.command("serve-scheduler")
+@click.option(
+    "--reload-interval",
+    type=float,
+    default=10,
+    help="Seconds between checks for changes to the config file (Default: 10)",
+)
+@click.pass_context
+def cmd(ctx, reload_interval):
+    """
+    Run action groups on the schedules in the config until stopped
+    """
+
+    cfg: Config = ctx.obj["config"]
+    paths: List[Path] = ctx.obj["config_paths"]
+    mtimes = _mtimes(paths)
+
+    # Stop cleanly when the container is stopped
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    jobs = [Job(s, datetime.datetime.now()) for s in cfg.schedules]
+    if not jobs:
+        print("No schedules in the config. Waiting for some to be added")
+    for job in jobs:
+        print(f"Scheduled '{job.schedule.action}' ({job.schedule.cron}). Next run at {job.due:%Y-%m-%d %H:%M}")
+
+    # Connections, templates and caches are kept between runs
+    services = systems.Services(cfg)
+    try:
+        next_check = time.monotonic() + reload_interval
+        while True:
+            for job in jobs:
+                if job.due <= datetime.datetime.now():
+                    _run(cfg, job, services)
+                    job.due = job.cron.next(datetime.datetime.now())
+                    print(f"Next run of '{job.schedule.action}' at {job.due:%Y-%m-%d %H:%M}")
+
+            if time.monotonic() >= next_check:
+                next_check = time.monotonic() + reload_interval
+                changed = _mtimes(paths)
+                if changed != mtimes:
+                    mtimes = changed
+                    try:
+                        new_cfg = load_config(paths, None, Config)
+                        new_cfg.sr_data = cfg.sr_data
+                        new_jobs = [Job(s, datetime.datetime.now()) for s in new_cfg.schedules]
+                    except Exception as e:
+                        print(f"Keeping the current config as the changed one can't be loaded: {e}")
+                    else:
+                        if new_cfg.model_dump(include=SERVICE_SETTINGS) != cfg.model_dump(
+                            include=SERVICE_SETTINGS
+                        ):
+                            services.close()
+                            services = systems.Services(new_cfg)
+                        services.cfg = new_cfg
+                        cfg, jobs = new_cfg, new_jobs
+                        print(f"Reloaded config with {len(jobs)} schedules")
+
+            # Sleep until the next run is due or it's time to check the config again
+            wait = next_check - time.monotonic()
+            if jobs:
+                wait = min(wait, (min(j.due for j in jobs) - datetime.datetime.now()).total_seconds())
+            time.sleep(max(wait, 0.1))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print("Stopping scheduler")
+        services.close()
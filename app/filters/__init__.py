@@ -1,3 +1,4 @@
+from .charts import pie_chart, bar_chart
 from .common import format_hours, format_time, pick_color, format_currency
 
 FILTERS = {
@@ -5,4 +6,6 @@ FILTERS = {
     "format_time": format_time,
     "pick_color": pick_color,
     "format_currency": format_currency,
+    "pie_chart": pie_chart,
+    "bar_chart": bar_chart,
 }
@@ -0,0 +1,163 @@
+"""
+Chart Filters available to templates
+
+Charts are drawn as inline SVG so templates render without loading a charting library or running Javascript.
+"""
+
+import math
+from html import escape
+
+from markupsafe import Markup
+
+from .common import format_time, pick_color
+
+FONT = "Outfit, sans-serif"
+LABEL_COLOR = "rgb(120, 120, 120)"
+BAR_COLOR = "#7dd3fc"
+
+
+def _attr(item, name):
+    return item[name] if isinstance(item, dict) else getattr(item, name)
+
+
+def _point(cx, cy, r, angle):
+    # Angles are in degrees clockwise from 12 o'clock
+    rad = math.radians(angle)
+    return cx + r * math.sin(rad), cy - r * math.cos(rad)
+
+
+def _segment(cx, cy, r_outer, r_inner, start, end):
+    # SVG path of a ring segment between two angles
+    large = 1 if end - start > 180 else 0
+    ox1, oy1 = _point(cx, cy, r_outer, start)
+    ox2, oy2 = _point(cx, cy, r_outer, end)
+    ix1, iy1 = _point(cx, cy, r_inner, end)
+    ix2, iy2 = _point(cx, cy, r_inner, start)
+    return (
+        f"M{ox1:.2f},{oy1:.2f} A{r_outer},{r_outer} 0 {large} 1 {ox2:.2f},{oy2:.2f} "
+        f"L{ix1:.2f},{iy1:.2f} A{r_inner},{r_inner} 0 {large} 0 {ix2:.2f},{iy2:.2f} Z"
+    )
+
+
+def pie_chart(items, value="duration", label="name", width=300, height=190):
+    # Draw a donut chart of items with each slice labelled by its percentage. Slices are colored with pick_color by
+    # their index so they match a table listing the items in the same order.
+    items = list(items)
+    values = [max(_attr(i, value) or 0, 0) for i in items]
+    total = sum(values)
+
+    cx, cy = width / 2, height / 2
+    r_outer = min(width, height) * 0.4
+    r_inner = min(width, height) * 0.2
+
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+        f'viewBox="0 0 {width} {height}" font-family="{FONT}" font-size="12">'
+    ]
+    angle = 0.0
+    for index, (item, v) in enumerate(zip(items, values)):
+        if not total or not v:
+            continue
+
+        sweep = 360 * v / total
+        color = pick_color(index)
+        title = f"<title>{escape(str(_attr(item, label)))}</title>"
+
+        # A single arc can't draw a full circle so split large slices in two
+        if sweep >= 359.99:
+            for start, end in ((angle, angle + 180), (angle + 180, angle + 360)):
+                path = _segment(cx, cy, r_outer, r_inner, start, end)
+                parts.append(f'<path d="{path}" fill="{color}">{title}</path>')
+        else:
+            path = _segment(cx, cy, r_outer, r_inner, angle, angle + sweep)
+            parts.append(
+                f'<path d="{path}" fill="{color}" stroke="#fff" stroke-width="1">'
+                f"{title}</path>"
+            )
+
+        # Label outside the slice with a line back to it
+        middle = angle + sweep / 2
+        x1, y1 = _point(cx, cy, r_outer, middle)
+        x2, y2 = _point(cx, cy, r_outer + 10, middle)
+        right = math.sin(math.radians(middle)) >= 0
+        x3 = x2 + (8 if right else -8)
+        parts.append(
+            f'<polyline points="{x1:.2f},{y1:.2f} {x2:.2f},{y2:.2f} {x3:.2f},{y2:.2f}" '
+            f'fill="none" stroke="{color}"/>'
+        )
+        parts.append(
+            f'<text x="{x3 + (3 if right else -3):.2f}" y="{y2:.2f}" '
+            f'text-anchor="{"start" if right else "end"}" dominant-baseline="middle" '
+            f'fill="{LABEL_COLOR}">{round(100 * v / total, 2):g}%</text>'
+        )
+
+        angle += sweep
+
+    parts.append("</svg>")
+    return Markup("".join(parts))
+
+
+def bar_chart(dates, width=700, height=100):
+    # Draw a bar chart of time per date from a mapping of date to a summary with a duration. Each bar is labelled
+    # with its formatted time and the dates are shown along the bottom.
+    summaries = [s for _, s in sorted(dates.items())]
+    count = len(summaries)
+
+    left, right, top, bottom = 15, 15, 15, 26
+    plot_width = width - left - right
+    plot_height = height - top - bottom
+    baseline = top + plot_height
+
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+        f'viewBox="0 0 {width} {height}" font-family="{FONT}" font-size="10" '
+        f'style="overflow: visible;">',
+        f'<line x1="{left}" y1="{baseline}" x2="{width - right}" y2="{baseline}" '
+        f'stroke="#6e7079"/>',
+    ]
+
+    if count:
+        band = plot_width / count
+        bar = band * 0.6
+        # Round the axis up to whole hours
+        top_hours = max(math.ceil(max(s.duration for s in summaries) / 3600), 1)
+        rotate = count > 15
+        # Skip date labels that would overlap
+        label_interval = max(math.ceil(56 / band), 1)
+
+        for index, s in enumerate(summaries):
+            x = left + band * index
+            centre = x + band / 2
+            bar_height = plot_height * (s.duration / 3600) / top_hours
+            y = baseline - bar_height
+
+            parts.append(
+                f'<rect x="{centre - bar / 2:.2f}" y="{y:.2f}" width="{bar:.2f}" '
+                f'height="{bar_height:.2f}" fill="{BAR_COLOR}"/>'
+            )
+
+            if rotate:
+                parts.append(
+                    f'<text x="{centre:.2f}" y="{y - 5:.2f}" fill="#000" '
+                    f'dominant-baseline="middle" transform="rotate(-90 {centre:.2f} {y - 5:.2f})">'
+                    f"{escape(format_time(s.duration))}</text>"
+                )
+            else:
+                parts.append(
+                    f'<text x="{centre:.2f}" y="{y - 5:.2f}" fill="#000" text-anchor="middle">'
+                    f"{escape(format_time(s.duration))}</text>"
+                )
+
+            parts.append(
+                f'<line x1="{centre:.2f}" y1="{baseline}" x2="{centre:.2f}" y2="{baseline + 5}" '
+                f'stroke="#6e7079"/>'
+            )
+            if index % label_interval == 0:
+                parts.append(
+                    f'<text x="{centre:.2f}" y="{baseline + 16}" fill="{LABEL_COLOR}" '
+                    f'text-anchor="middle" dominant-baseline="hanging">'
+                    f'{s.date.strftime("%d/%m/%Y")}</text>'
+                )
+
+    parts.append("</svg>")
+    return Markup("".join(parts))
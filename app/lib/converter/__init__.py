@@ -0,0 +1,6 @@
+from .cache import Cache
+from .converter import Converter
+from .gotenberg import GotenbergRenderer
+from .renderer import Renderer
+from .resources import Resource, ResourceManager
+from .weasy import WeasyPrintRenderer
@@ -0,0 +1,121 @@
+import hashlib
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, Optional, List
+
+from .resources import Resource
+
+
+class Cache(object):
+    """
+    Content addressed store of rendered PDFs.
+
+    PDFs are keyed by a hash of everything sent to the renderer so an unchanged report is never converted twice. The
+    modification time of each entry records when it was last used and the least recently used entries are evicted
+    once the cache grows over its size limit.
+    """
+
+    SUFFIX = ".pdf"
+
+    def __init__(self, path: Path, size_limit: Optional[int] = None):
+        """
+        :param path: Directory to store cached PDFs in
+        :param size_limit: Maximum size of the cache in bytes. None is unlimited
+        """
+        self.path = Path(path)
+        self.size_limit = size_limit
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(
+        index: str | List[str],
+        footer: str,
+        resources: Dict[str, Resource],
+        margins: Dict[str, int],
+        renderer: str = "",
+    ) -> str:
+        """
+        Calculate the cache key for a conversion
+        :param index: Rendered index HTML or list of parts
+        :param footer: Rendered footer HTML
+        :param resources: Resources sent to the renderer
+        :param margins: Page margins
+        :param renderer: Name of the renderer backend
+        :return: Hex digest
+        """
+        h = hashlib.sha256(renderer.encode("utf-8"))
+        parts = [index] if isinstance(index, str) else index
+        h.update(len(parts).to_bytes(8, "big"))
+        for part in list(parts) + [footer]:
+            encoded = part.encode("utf-8")
+            h.update(len(encoded).to_bytes(8, "big"))
+            h.update(encoded)
+
+        for name, resource in sorted(resources.items()):
+            h.update(name.encode("utf-8"))
+            h.update(resource.digest.encode("ascii"))
+
+        h.update(repr(sorted(margins.items())).encode("utf-8"))
+        return h.hexdigest()
+
+    def _entry(self, key: str) -> Path:
+        return self.path.joinpath(key + self.SUFFIX)
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Lookup a cached PDF, marking it as recently used
+        :param key: Cache key
+        :return: PDF or None if not cached
+        """
+        entry = self._entry(key)
+        with self._lock:
+            try:
+                os.utime(entry)
+                return entry.read_bytes()
+            except FileNotFoundError:
+                return None
+
+    def put(self, key: str, pdf: bytes) -> None:
+        """
+        Store a PDF in the cache then evict old entries if over the size limit
+        :param key: Cache key
+        :param pdf: PDF
+        """
+        self.path.mkdir(parents=True, exist_ok=True)
+
+        # Write to a temporary file first so a partially written entry is never visible
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(pdf)
+            os.replace(tmp, self._entry(key))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+        self.evict()
+
+    def evict(self) -> None:
+        """
+        Remove the least recently used entries until the cache fits in its size limit
+        """
+        if self.size_limit is None:
+            return
+
+        with self._lock:
+            entries = []
+            for entry in self.path.glob("*" + self.SUFFIX):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, entry in sorted(entries):
+                if total <= self.size_limit:
+                    break
+                entry.unlink(missing_ok=True)
+                total -= size
@@ -0,0 +1,146 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional, List, Sequence, TypeVar, BinaryIO
+
+from .cache import Cache
+from .merge import count_pages, merge
+from .renderer import Renderer
+from .resources import Resource, ResourceManager
+
+T = TypeVar("T")
+
+# Margins in pixels
+DEFAULT_MARGINS = {"bottom": 100}
+
+BLANK_FOOTER = "<html><body></body></html>"
+
+
+class Converter(object):
+    """
+    Converts rendered HTML into a PDF, reusing a previously rendered PDF from the cache where possible.
+
+    Large reports can be rendered in parts which are converted concurrently and merged together.
+    """
+
+    def __init__(
+        self,
+        renderer: Renderer,
+        cache: Optional[Cache] = None,
+        resource_manager: Optional[ResourceManager] = None,
+        chunk_size: Optional[int] = None,
+        workers: int = 4,
+    ):
+        """
+        :param renderer: Backend used to render PDFs
+        :param cache: Optional cache of rendered PDFs
+        :param resource_manager: Loads resources. Defaults to one that does not inline or downsample
+        :param chunk_size: Number of items in each part when splitting large reports. None never splits
+        :param workers: Number of parts converted at once
+        """
+        self.renderer = renderer
+        self.cache = cache
+        self.resource_manager = resource_manager or ResourceManager()
+        self.chunk_size = chunk_size
+        self.workers = workers
+
+    def resources(self, resources: Dict[str, Path], inline: bool = False) -> Dict[str, Resource]:
+        """
+        Load resources for a report. Templates should refer to each resource by its `url`.
+        :param resources: Paths of resources mapped by name
+        :param inline: Inline every resource as a data URI, for HTML that is not converted
+        :return: Resources mapped by name
+        """
+        return self.resource_manager.resolve(resources, inline)
+
+    def split(self, items: Sequence[T]) -> List[Sequence[T]]:
+        """
+        Split the detail items of a report into chunks that are each rendered as a separate part
+        :param items: Items in the order they are shown in the report
+        :return: List of chunks. A single chunk if the report does not need splitting
+        """
+        if not self.chunk_size or len(items) <= self.chunk_size:
+            return [items]
+
+        return [
+            items[i : i + self.chunk_size]
+            for i in range(0, len(items), self.chunk_size)
+        ]
+
+    def convert(
+        self,
+        index: str | List[str],
+        footer: str,
+        output: Path | str | BinaryIO | None = None,
+        resources: Dict[str, Resource] = None,
+        margins: Dict[str, int] = None,
+    ) -> bytes:
+        """
+        Convert HTML to a PDF
+        :param index: Rendered index HTML or a list of parts that are rendered separately and merged in order
+        :param footer: Rendered footer HTML
+        :param output: Optional file name or binary file object to also write the PDF to
+        :param resources: Resources readable by the HTML, mapped by name, as returned by `resources()`
+        :param margins: Page margins in pixels
+        :return: PDF
+        """
+        parts = [index] if isinstance(index, str) else index
+        # Inlined resources are already part of the HTML
+        resources = {k: v for k, v in (resources or {}).items() if not v.inline}
+        margins = margins if margins is not None else DEFAULT_MARGINS
+
+        key = None
+        pdf = None
+        if self.cache is not None:
+            key = self.cache.key(
+                parts, footer, resources, margins, renderer=self.renderer.name
+            )
+            pdf = self.cache.get(key)
+
+        if pdf is None:
+            if len(parts) == 1:
+                pdf = self.renderer.render(parts[0], footer, resources, margins)
+            else:
+                pdf = self._convert_parts(parts, footer, resources, margins)
+
+            if key is not None:
+                self.cache.put(key, pdf)
+
+        if output is not None:
+            if hasattr(output, "write"):
+                output.write(pdf)
+            else:
+                Path(output).write_bytes(pdf)
+
+        return pdf
+
+    def _convert_parts(
+        self,
+        parts: List[str],
+        footer: str,
+        resources: Dict[str, Resource],
+        margins: Dict[str, int],
+    ) -> bytes:
+        # Parts are rendered without a footer as each would number its pages from 1
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pdfs = list(
+                executor.map(
+                    lambda part: self.renderer.render(
+                        part, BLANK_FOOTER, resources, margins
+                    ),
+                    parts,
+                )
+            )
+
+        # Render the footer once over blank pages for the whole document so page numbering is continuous, then
+        # stamp it over the merged parts
+        pages = sum(count_pages(pdf) for pdf in pdfs)
+        overlay = self.renderer.render(
+            "<html><body>{}<div></div></body></html>".format(
+                '<div style="break-after: page;"></div>' * (pages - 1)
+            ),
+            footer,
+            resources,
+            margins,
+        )
+
+        return merge(pdfs, overlay=overlay)
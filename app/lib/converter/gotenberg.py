@@ -0,0 +1,51 @@
+import io
+from typing import Dict, Callable, ContextManager
+
+from gotenberg_client import GotenbergClient
+from gotenberg_client.options import PageMarginsType, Measurement, MeasurementUnitType
+
+from .renderer import Renderer
+from .resources import Resource
+
+
+class GotenbergRenderer(Renderer):
+    """
+    Render through Chromium running in a Gotenberg container
+    """
+
+    name = "gotenberg"
+
+    def __init__(self, gotenberg: Callable[[], ContextManager[GotenbergClient]]):
+        self.gotenberg = gotenberg
+
+    def render(
+        self,
+        index: str,
+        footer: str,
+        resources: Dict[str, Resource],
+        margins: Dict[str, int],
+    ) -> bytes:
+        with self.gotenberg() as client:
+            with client.chromium.html_to_pdf() as route:
+                builder = (
+                    route.string_index(index)
+                    .margins(
+                        PageMarginsType(
+                            **{
+                                k: Measurement(v, MeasurementUnitType.Pixels)
+                                for k, v in margins.items()
+                            }
+                        )
+                    )
+                    # The footer is sent from memory under the name Gotenberg expects
+                    .string_resource(footer, name="footer.html", mime_type="text/html")
+                )
+
+                for name, resource in resources.items():
+                    builder.string_resource(
+                        io.BytesIO(resource.content),
+                        name=name,
+                        mime_type=resource.mime_type,
+                    )
+
+                return builder.run().content
@@ -0,0 +1,35 @@
+import io
+from typing import List, Optional
+
+from pypdf import PdfReader, PdfWriter
+
+
+def count_pages(pdf: bytes) -> int:
+    """
+    Count the pages in a PDF
+    :param pdf: PDF
+    :return: Number of pages
+    """
+    return len(PdfReader(io.BytesIO(pdf)).pages)
+
+
+def merge(pdfs: List[bytes], overlay: Optional[bytes] = None) -> bytes:
+    """
+    Merge PDFs into one
+    :param pdfs: PDFs in the order to merge them
+    :param overlay: Optional PDF with a page for each merged page that is stamped over the top of it
+    :return: Merged PDF
+    """
+    writer = PdfWriter()
+    for pdf in pdfs:
+        writer.append(io.BytesIO(pdf))
+
+    if overlay is not None:
+        for page, overlay_page in zip(
+            writer.pages, PdfReader(io.BytesIO(overlay)).pages
+        ):
+            page.merge_page(overlay_page)
+
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
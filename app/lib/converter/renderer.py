@@ -0,0 +1,31 @@
+import abc
+from typing import Dict
+
+from .resources import Resource
+
+
+class Renderer(abc.ABC):
+    """
+    Base class for backends that render HTML into a PDF
+    """
+
+    # Name of the backend. Part of the cache key as each backend lays out pages differently
+    name = "renderer"
+
+    @abc.abstractmethod
+    def render(
+        self,
+        index: str,
+        footer: str,
+        resources: Dict[str, Resource],
+        margins: Dict[str, int],
+    ) -> bytes:
+        """
+        Render HTML to a PDF
+        :param index: Rendered index HTML
+        :param footer: Rendered footer HTML. Elements with class `pageNumber` and `totalPages` are filled in with the
+                       current page and total number of pages
+        :param resources: Additional files readable by the HTML, mapped by name
+        :param margins: Page margins in pixels
+        :return: PDF
+        """
@@ -0,0 +1,108 @@
+import base64
+import hashlib
+import io
+import mimetypes
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+
+class Resource(object):
+    """
+    A file made available to the HTML being rendered
+    """
+
+    def __init__(self, name: str, content: bytes, digest: str, inline: bool = False):
+        """
+        :param name: Name the HTML refers to the resource by
+        :param content: Contents of the resource
+        :param digest: SHA256 hex digest of the contents
+        :param inline: Whether the resource is inlined into the HTML as a data URI instead of sent alongside it
+        """
+        self.name = name
+        self.content = content
+        self.mime_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        self.digest = digest
+        self.inline = inline
+
+    @property
+    def url(self) -> str:
+        """
+        URL the HTML should use to refer to the resource
+        """
+        if self.inline:
+            return "data:{};base64,{}".format(
+                self.mime_type, base64.b64encode(self.content).decode("ascii")
+            )
+        return self.name
+
+
+class ResourceManager(object):
+    """
+    Loads resources once, optionally shrinking images and inlining small resources as data URIs
+    """
+
+    def __init__(self, inline_max_size: int = 0, image_max_size: Optional[int] = None):
+        """
+        :param inline_max_size: Resources up to this many bytes are inlined. 0 never inlines
+        :param image_max_size: Downsample images larger than this many pixels on their longest side. None never
+                               downsamples
+        """
+        self.inline_max_size = inline_max_size
+        self.image_max_size = image_max_size
+        self._loaded: Dict[Path, Tuple[bytes, str]] = {}
+        self._lock = threading.Lock()
+
+    def _optimize_image(self, content: bytes) -> bytes:
+        try:
+            from PIL import Image
+        except ImportError:
+            raise Exception(
+                "Downsampling images needs Pillow installed (pip install pillow)"
+            )
+
+        image = Image.open(io.BytesIO(content))
+        image_format = image.format
+        if max(image.size) <= self.image_max_size:
+            return content
+
+        image.thumbnail((self.image_max_size, self.image_max_size))
+        buffer = io.BytesIO()
+        image.save(buffer, format=image_format, optimize=True)
+
+        # Keep the original if recompressing didn't help
+        return buffer.getvalue() if buffer.tell() < len(content) else content
+
+    def load(self, path: Path) -> Tuple[bytes, str]:
+        """
+        Read and hash a file, optimizing it if it is an image. Each file is only read once.
+        :param path: Path of file
+        :return: Contents and their SHA256 hex digest
+        """
+        path = Path(path).resolve()
+        with self._lock:
+            if path not in self._loaded:
+                content = path.read_bytes()
+                mime_type = mimetypes.guess_type(path.name)[0] or ""
+                if self.image_max_size and mime_type.startswith("image/"):
+                    content = self._optimize_image(content)
+                self._loaded[path] = (content, hashlib.sha256(content).hexdigest())
+            return self._loaded[path]
+
+    def resolve(self, resources: Dict[str, Path], inline: bool = False) -> Dict[str, Resource]:
+        """
+        Load resources
+        :param resources: Paths of resources mapped by the name the HTML refers to them by
+        :param inline: Inline every resource whatever its size, such as for HTML that is opened on its own
+        :return: Resources mapped by name
+        """
+        ret = {}
+        for name, path in resources.items():
+            content, digest = self.load(path)
+            ret[name] = Resource(
+                name,
+                content,
+                digest,
+                inline=inline or 0 < len(content) <= self.inline_max_size,
+            )
+        return ret
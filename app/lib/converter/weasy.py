@@ -0,0 +1,113 @@
+import re
+from typing import Dict
+
+from .renderer import Renderer
+from .resources import Resource
+
+# Base URL the index is loaded from. Relative links resolve under here and are served from resources.
+BASE_URL = "file:///sr-resources/"
+
+# Match Chromium's defaults as used by Gotenberg so both backends paginate alike
+PAGE_CSS = """
+@page {{
+    size: 8.5in 11in;
+    margin: 0.39in;
+    {margins}
+    @bottom-left {{
+        content: element(sr-footer);
+        width: 100%;
+        vertical-align: top;
+    }}
+}}
+.sr-footer {{
+    position: running(sr-footer);
+}}
+/* Chromium positions footers absolutely inside the margin which does not apply to a running element */
+.sr-footer > * {{
+    position: static !important;
+}}
+.sr-footer .pageNumber::after {{
+    content: counter(page);
+}}
+.sr-footer .totalPages::after {{
+    content: counter(pages);
+}}
+"""
+
+STYLE_RE = re.compile(r"<style[^>]*>.*?</style>", re.I | re.S)
+BODY_RE = re.compile(r"<body[^>]*>(.*?)</body>", re.I | re.S)
+
+
+class WeasyPrintRenderer(Renderer):
+    """
+    Render in-process with WeasyPrint. No Gotenberg is needed but Javascript in templates is not run.
+    """
+
+    name = "weasyprint"
+
+    def __init__(self):
+        try:
+            import weasyprint
+        except (ImportError, OSError):
+            raise Exception(
+                "The weasyprint renderer needs WeasyPrint installed (pip install weasyprint)"
+            )
+        self.weasyprint = weasyprint
+
+    @staticmethod
+    def _footer(index: str, footer: str) -> str:
+        """
+        Move the footer into the index as a running element placed in the bottom margin of each page
+        """
+        styles = "".join(STYLE_RE.findall(footer))
+        body = BODY_RE.search(footer)
+        element = '<div class="sr-footer">{}</div>'.format(
+            body.group(1) if body else STYLE_RE.sub("", footer)
+        )
+
+        if re.search(r"</head>", index, re.I):
+            index = re.sub(
+                r"</head>", lambda m: styles + m.group(0), index, count=1, flags=re.I
+            )
+        else:
+            element = styles + element
+
+        # The running element must come first so it is in place from the first page
+        if re.search(r"<body[^>]*>", index, re.I):
+            return re.sub(
+                r"<body[^>]*>",
+                lambda m: m.group(0) + element,
+                index,
+                count=1,
+                flags=re.I,
+            )
+        return element + index
+
+    def render(
+        self,
+        index: str,
+        footer: str,
+        resources: Dict[str, Resource],
+        margins: Dict[str, int],
+    ) -> bytes:
+        def url_fetcher(url, *args, **kwargs):
+            if url.startswith(BASE_URL):
+                name = url[len(BASE_URL) :]
+                if name in resources:
+                    return {
+                        "string": resources[name].content,
+                        "mime_type": resources[name].mime_type,
+                    }
+            return self.weasyprint.default_url_fetcher(url, *args, **kwargs)
+
+        css = PAGE_CSS.format(
+            margins="".join(
+                "margin-{}: {}px;".format(k, v) for k, v in margins.items()
+            )
+        )
+
+        return self.weasyprint.HTML(
+            string=self._footer(index, footer),
+            base_url=BASE_URL,
+            url_fetcher=url_fetcher,
+        ).write_pdf(stylesheets=[self.weasyprint.CSS(string=css)])
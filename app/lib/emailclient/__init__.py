@@ -1,3 +1,5 @@
 from .attachment import File
+from .dispatch import Tracker
 from .email import Email
 from .manager import Manager
+from .outbox import Outbox
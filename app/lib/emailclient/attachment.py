@@ -10,12 +10,31 @@ class AttachType(Enum):
 
 
 class File(object):
+    """
+    A file to attach or embed, either read from path or held in memory as content
+    """
+
     def __init__(
         self,
-        path: str,
+        path: Optional[str] = None,
         name: Optional[str] = None,
         typeof: AttachType = AttachType.APPLICATION,
+        content: Optional[bytes] = None,
     ):
+        if path is None and (content is None or name is None):
+            raise ValueError("A File needs a path, or content and a name")
+
         self.path = path
+        self.content = content
         self.name = name if name is not None else os.path.basename(path)
         self.typeof = typeof
+
+    def read(self) -> bytes:
+        """
+        Get the contents of the file
+        """
+        if self.content is not None:
+            return self.content
+
+        with open(self.path, "rb") as f:
+            return f.read()
@@ -0,0 +1,135 @@
+import smtplib
+import threading
+from smtplib import SMTP
+from typing import List, Optional
+
+from .stream import DataWriter, MessageSource, write_source
+
+
+class Connection(object):
+    """
+    An SMTP session that is opened on first use then reused for following messages. The session is reopened after
+    max_messages have been sent over it or if the server drops it.
+    """
+
+    def __init__(
+        self,
+        *,
+        host: str,
+        port: int = 587,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        max_messages: Optional[int] = None,
+    ):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.max_messages = max_messages
+
+        self._smtp: Optional[SMTP] = None
+        self._sent = 0
+        self._lock = threading.Lock()
+
+    def _open(self) -> SMTP:
+        if self._smtp is None:
+            smtp = SMTP(self.host, self.port)
+            if self.username is not None:
+                smtp.login(self.username, self.password)
+            self._smtp = smtp
+            self._sent = 0
+        return self._smtp
+
+    def _close(self) -> None:
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except smtplib.SMTPException:
+                self._smtp.close()
+            except OSError:
+                pass
+            self._smtp = None
+
+    def _drop(self, smtp: SMTP) -> None:
+        # Close a session without ending it cleanly, such as one left in the middle of sending a message
+        try:
+            smtp.close()
+        except OSError:
+            pass
+        if self._smtp is smtp:
+            self._smtp = None
+
+    def _send_stream(self, smtp: SMTP, from_addr: str, to_addrs: List[str], msg: MessageSource) -> None:
+        # The same as SMTP.sendmail() but the message is written to the socket as it is serialized
+        smtp.ehlo_or_helo_if_needed()
+
+        code, resp = smtp.mail(from_addr)
+        if code != 250:
+            smtp.rset()
+            raise smtplib.SMTPSenderRefused(code, resp, from_addr)
+
+        refused = {}
+        for to in to_addrs:
+            code, resp = smtp.rcpt(to)
+            if code not in (250, 251):
+                refused[to] = (code, resp)
+        if len(refused) == len(to_addrs):
+            smtp.rset()
+            raise smtplib.SMTPRecipientsRefused(refused)
+
+        code, resp = smtp.docmd("data")
+        if code != 354:
+            smtp.rset()
+            raise smtplib.SMTPDataError(code, resp)
+
+        try:
+            writer = DataWriter(smtp.sock)
+            write_source(msg, writer)
+            writer.close()
+
+            code, resp = smtp.getreply()
+        except BaseException:
+            # The session is left part way through the message so it can't be used again
+            self._drop(smtp)
+            raise
+        if code != 250:
+            smtp.rset()
+            raise smtplib.SMTPDataError(code, resp)
+
+    def _send(self, from_addr: str, to_addrs: List[str], msg: MessageSource) -> None:
+        if isinstance(msg, (str, bytes)):
+            self._open().sendmail(from_addr, to_addrs, msg)
+        else:
+            self._send_stream(self._open(), from_addr, to_addrs, msg)
+
+    def send(self, from_addr: str, to_addrs: List[str], msg: MessageSource) -> None:
+        """
+        Send a message, reconnecting once if the session was dropped
+        :param from_addr: Envelope sender
+        :param to_addrs: Envelope recipients
+        :param msg: Message. Messages and files are streamed to the server rather than serialized first
+        """
+        # Files are rewound to here if the message has to be sent again
+        start = msg.tell() if hasattr(msg, "tell") else None
+
+        with self._lock:
+            if self.max_messages is not None and self._sent >= self.max_messages:
+                self._close()
+
+            try:
+                self._send(from_addr, to_addrs, msg)
+            except (smtplib.SMTPServerDisconnected, ConnectionError):
+                # Server dropped an idle session so try again on a new one
+                self._smtp = None
+                if start is not None:
+                    msg.seek(start)
+                self._send(from_addr, to_addrs, msg)
+
+            self._sent += 1
+
+    def close(self) -> None:
+        """
+        Close the session if open
+        """
+        with self._lock:
+            self._close()
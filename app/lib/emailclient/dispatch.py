@@ -0,0 +1,247 @@
+import contextvars
+import queue
+import smtplib
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+
+from .connection import Connection
+from .stream import MessageSource
+
+
+def is_temporary(error: Exception) -> bool:
+    """
+    Whether an SMTP error is a temporary (4xx) failure worth retrying
+    """
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return bool(error.recipients) and all(
+            400 <= code < 500 for code, _ in error.recipients.values()
+        )
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    return False
+
+
+class RateLimiter(object):
+    """
+    Spaces out calls so no more than rate happen per second across all threads
+    """
+
+    def __init__(self, rate: Optional[float] = None):
+        """
+        :param rate: Calls per second. None is unlimited
+        """
+        self.interval = 1 / rate if rate else 0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        if not self.interval:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class Tracker(object):
+    """
+    Follows a set of queued messages, such as the emails of one step, so whoever queued them can wait for just those
+    and hear which of them failed
+    """
+
+    def __init__(self):
+        self._pending = 0
+        self._failures: List[Tuple[List[str], Exception]] = []
+        self._done = threading.Condition()
+
+    def _add(self) -> None:
+        with self._done:
+            self._pending += 1
+
+    def _finish(self, to_addrs: List[str], error: Optional[Exception] = None) -> None:
+        with self._done:
+            self._pending -= 1
+            if error is not None:
+                self._failures.append((to_addrs, error))
+            self._done.notify_all()
+
+    def wait(self) -> List[Tuple[List[str], Exception]]:
+        """
+        Wait for the messages followed to be sent
+        :return: Recipients and error of each message that failed since the last wait
+        """
+        with self._done:
+            self._done.wait_for(lambda: self._pending == 0)
+            failures, self._failures = self._failures, []
+        return failures
+
+
+class DispatchQueue(object):
+    """
+    Sends messages in the background from a pool of workers, each with its own SMTP connection
+
+    Messages that fail with a temporary 4xx error are retried with exponential backoff. Other failures are collected
+    and returned by drain(), or by the Tracker the message was queued with. Each message can carry callbacks to hear
+    whether it was sent.
+    """
+
+    def __init__(
+        self,
+        connection_factory: Callable[[], Connection],
+        *,
+        workers: int = 1,
+        rate: Optional[float] = None,
+        retries: int = 3,
+        backoff: float = 2.0,
+    ):
+        """
+        :param connection_factory: Creates a connection for each worker
+        :param workers: Number of workers sending at once
+        :param rate: Messages per second across all workers. None is unlimited
+        :param retries: Number of times to retry a message after a temporary error
+        :param backoff: Seconds to wait before the first retry, doubling for each following retry
+        """
+        self.connection_factory = connection_factory
+        self.workers = max(workers, 1)
+        self.retries = retries
+        self.backoff = backoff
+
+        self._limiter = RateLimiter(rate)
+        # Bounded so callers producing faster than the workers send are held back rather than buffering every message
+        self._queue: queue.Queue = queue.Queue(maxsize=self.workers * 4)
+        self._failures: List[Tuple[List[str], Exception]] = []
+        self._lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._threads:
+                return
+            for index in range(self.workers):
+                thread = threading.Thread(
+                    target=self._work, name="email-dispatch-{}".format(index), daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def _send(self, connection: Connection, from_addr: str, to_addrs: List[str], msg: MessageSource) -> None:
+        # Files are rewound to here before each retry
+        start = msg.tell() if hasattr(msg, "tell") else None
+
+        attempt = 0
+        while True:
+            self._limiter.wait()
+            if start is not None:
+                msg.seek(start)
+            try:
+                connection.send(from_addr, to_addrs, msg)
+                return
+            except smtplib.SMTPException as e:
+                if attempt >= self.retries or not is_temporary(e):
+                    raise
+                time.sleep(self.backoff * 2 ** attempt)
+                attempt += 1
+
+    def _deliver(
+        self,
+        connection: Connection,
+        from_addr: str,
+        to_addrs: List[str],
+        msg: MessageSource,
+        on_sent: Optional[Callable[[], None]],
+        on_failed: Optional[Callable[[Exception], None]],
+        tracker: Optional[Tracker],
+    ) -> None:
+        try:
+            self._send(connection, from_addr, to_addrs, msg)
+        except Exception as e:
+            if tracker is None:
+                with self._lock:
+                    self._failures.append((to_addrs, e))
+            self._callback(on_failed, e)
+            if tracker is not None:
+                tracker._finish(to_addrs, e)
+        else:
+            self._callback(on_sent)
+            if tracker is not None:
+                tracker._finish(to_addrs)
+
+    @staticmethod
+    def _callback(callback: Optional[Callable], *args) -> None:
+        # A callback that fails mustn't take down the worker, or messages behind it would never be sent
+        if callback is None:
+            return
+        try:
+            callback(*args)
+        except Exception as e:
+            print("Error after sending email: {}".format(e))
+
+    def _work(self) -> None:
+        connection = self.connection_factory()
+        try:
+            while True:
+                item = self._queue.get()
+                try:
+                    if item is None:
+                        return
+
+                    # Each message is sent in the context it was queued from, so anything its callbacks write goes
+                    # to the output of whoever queued it
+                    context, from_addr, to_addrs, msg, on_sent, on_failed, tracker = item
+                    context.run(self._deliver, connection, from_addr, to_addrs, msg, on_sent, on_failed, tracker)
+                finally:
+                    self._queue.task_done()
+        finally:
+            connection.close()
+
+    def put(
+        self,
+        from_addr: str,
+        to_addrs: List[str],
+        msg: MessageSource,
+        on_sent: Optional[Callable[[], None]] = None,
+        on_failed: Optional[Callable[[Exception], None]] = None,
+        tracker: Optional[Tracker] = None,
+    ) -> None:
+        """
+        Queue a message to send, waiting if the queue is full
+        :param from_addr: Envelope sender
+        :param to_addrs: Envelope recipients
+        :param msg: Message
+        :param on_sent: Called once the message is sent
+        :param on_failed: Called with the error if the message can't be sent
+        :param tracker: Tracker to follow the message with. Its failure is then returned by the tracker, not drain()
+        """
+        self._start()
+        if tracker is not None:
+            tracker._add()
+        self._queue.put((contextvars.copy_context(), from_addr, to_addrs, msg, on_sent, on_failed, tracker))
+
+    def drain(self) -> List[Tuple[List[str], Exception]]:
+        """
+        Wait for all queued messages to be sent, including those followed by trackers
+        :return: Recipients and error of each message not followed by a tracker that failed since the last drain
+        """
+        self._queue.join()
+        with self._lock:
+            failures, self._failures = self._failures, []
+        return failures
+
+    def close(self) -> List[Tuple[List[str], Exception]]:
+        """
+        Send all queued messages then stop the workers and close their connections
+        :return: Recipients and error of each message that failed since the last drain
+        """
+        failures = self.drain()
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join()
+        return failures
@@ -1,20 +1,15 @@
 from __future__ import annotations
 
-from email.mime.application import MIMEApplication
-from email.mime.audio import MIMEAudio
-from email.mime.image import MIMEImage
 from email.mime.multipart import MIMEMultipart
-from email.mime.nonmultipart import MIMENonMultipart
 from email.mime.text import MIMEText
-from smtplib import SMTP
-from typing import List, Optional, Dict, TYPE_CHECKING
+from typing import Callable, List, Optional, Dict, TYPE_CHECKING
 
 import jinja2 as jinja2
-from mjml import mjml2html
 
 from .attachment import AttachType, File
 
 if TYPE_CHECKING:
+    from .dispatch import Tracker
     from .manager import Manager
 
 
@@ -34,9 +29,9 @@ class Email(object):
         self.attach: List[File] = []
         self.embed: List[File] = []
 
-    def send(self) -> None:
+    def message(self) -> MIMEMultipart:
         """
-        Send the email
+        Build the MIME message of the email
         """
 
         msg = MIMEMultipart("mixed")
@@ -67,10 +62,8 @@ class Email(object):
             msg_html = MIMEMultipart("related")
             msg_html.attach(
                 MIMEText(
-                    mjml2html(
-                        self._manager.jinja.get_template(
-                            "{}.mjml".format(self.template)
-                        ).render(**self.template_args)
+                    self._manager.mjml.render(
+                        "{}.mjml".format(self.template), self.template_args
                     ),
                     "html",
                     "UTF-8",
@@ -78,20 +71,9 @@ class Email(object):
             )
 
             # Attach embedded files
-            data: MIMENonMultipart
             for a in self.embed:
                 try:
-                    with open(a.path, "rb") as f:
-                        if a.typeof == AttachType.IMAGE:
-                            data = MIMEImage(f.read())
-                        elif a.typeof == AttachType.AUDIO:
-                            data = MIMEAudio(f.read())
-                        else:
-                            data = MIMEApplication(f.read())
-
-                        data.add_header("Content-ID", "<{}>".format(a.name))
-
-                    msg_html.attach(data)
+                    msg_html.attach(self._manager.parts.get(a))
                 except IOError:
                     # Failed Embed
                     pass
@@ -100,22 +82,21 @@ class Email(object):
 
         # Attach files
         for a in self.attach:
-            with open(a.path, "rb") as f:
-                if a.typeof == AttachType.IMAGE:
-                    data = MIMEImage(f.read())
-                elif a.typeof == AttachType.AUDIO:
-                    data = MIMEAudio(f.read())
-                else:
-                    data = MIMEApplication(f.read())
-
-                data.add_header("Content-ID", "<{}>".format(a.name))
-                data.add_header(
-                    "Content-Disposition", 'attachment; filename="{}"'.format(a.name)
-                )
-                msg.attach(data)
+            msg.attach(self._manager.parts.get(a, attachment=True))
+
+        return msg
 
-        # Send Email
-        s = SMTP(self._manager.host, self._manager.port)
-        s.login(self._manager.username, self._manager.password)
-        s.sendmail(self._manager.from_email, msg["To"], msg.as_string())
-        s.quit()
+    def send(self) -> None:
+        """
+        Send the email
+        """
+        self._manager.send(self.to, self.message())
+
+    def enqueue(self, on_sent: Optional[Callable[[], None]] = None, tracker: Optional[Tracker] = None) -> None:
+        """
+        Queue the email to be sent in the background. Call Manager.drain(), or wait on the tracker, to wait for queued
+        emails to be sent.
+        :param on_sent: Called once the email is sent, or written to the outbox if there is one
+        :param tracker: Tracker following the emails of whoever queued this one
+        """
+        self._manager.enqueue(self.to, self.message(), on_sent=on_sent, tracker=tracker)
@@ -1,14 +1,38 @@
 from os import PathLike
-from typing import Sequence
+from pathlib import Path
+from typing import Callable, Sequence, List, Optional, Tuple
 
 import jinja2
 
+from .connection import Connection
+from .dispatch import DispatchQueue, Tracker
 from .email import Email
+from .mjml_compiler import MjmlRenderer
+from .outbox import Outbox
+from .parts import PartCache
+from .stream import MessageSource
 
 
 class Manager(object):
     """
     Email Manager
+
+    Emails are sent over a single SMTP session which is opened on first use. Close the manager, or use it as a context
+    manager, to end the session once done.
+
+    Emails can instead be queued to send in the background by dispatch_workers workers, each with its own SMTP
+    session, limited to messages_per_second. Messages failing with a temporary 4xx error are retried up to retries
+    times, backing off from retry_backoff seconds.
+
+    If an outbox is given, queued messages are first written to it and only marked delivered once the server accepts
+    them, so those left over from a failed run can be sent later with flush_outbox().
+
+    Attachments and embeds are encoded once per manager and reused for every message that carries the same file.
+
+    Messages are streamed to the server, or to the outbox, as they are serialized rather than built as one string first.
+
+    With precompile_templates set, MJML templates are compiled to HTML once (and kept in template_cache if given)
+    instead of for every message.
     """
 
     def __init__(
@@ -21,6 +45,14 @@ class Manager(object):
             from_name: str,
             from_email: str,
             templates:  str | PathLike[str] | Sequence[str | PathLike[str]],
+            max_messages_per_connection: Optional[int] = None,
+            precompile_templates: bool = False,
+            template_cache: Optional[Path] = None,
+            dispatch_workers: int = 1,
+            messages_per_second: Optional[float] = None,
+            retries: int = 3,
+            retry_backoff: float = 2.0,
+            outbox: Optional[Outbox] = None,
     ):
         self.host = host
         self.port = port
@@ -29,6 +61,17 @@ class Manager(object):
         self.from_name = from_name
         self.from_email = from_email
         self.templates = templates or []
+        self.max_messages_per_connection = max_messages_per_connection
+        self.outbox = outbox
+
+        self._connection = self._new_connection()
+        self._queue = DispatchQueue(
+            self._new_connection,
+            workers=dispatch_workers,
+            rate=messages_per_second,
+            retries=retries,
+            backoff=retry_backoff,
+        )
 
         # Load Jinja Template Manager
         self.jinja = jinja2.Environment(
@@ -36,9 +79,110 @@ class Manager(object):
             autoescape=jinja2.select_autoescape(['html', 'xml'])
         )
 
+        self.parts = PartCache()
+        self.mjml = MjmlRenderer(self.jinja, precompile=precompile_templates, cache_path=template_cache)
+
+    def _new_connection(self) -> Connection:
+        return Connection(
+            host=self.host,
+            port=self.port,
+            username=self.username,
+            password=self.password,
+            max_messages=self.max_messages_per_connection,
+        )
+
     @property
     def from_full(self) -> str:
         return "{} <{}>".format(self.from_name, self.from_email)
 
     def new(self) -> Email:
         return Email(self)
+
+    def send(self, to: List[str], msg: MessageSource) -> None:
+        """
+        Send a message over the shared SMTP session
+        :param to: Recipients
+        :param msg: Message
+        """
+        self._connection.send(self.from_email, to, msg)
+
+    def enqueue(
+        self,
+        to: List[str],
+        msg: MessageSource,
+        on_sent: Optional[Callable[[], None]] = None,
+        tracker: Optional[Tracker] = None,
+    ) -> None:
+        """
+        Queue a message to send in the background, waiting if the queue is full
+        :param to: Recipients
+        :param msg: Message
+        :param on_sent: Called once the message is sent or, if there is an outbox, once it is safely spooled
+        :param tracker: Tracker to wait for the message and hear whether it failed with, instead of drain()
+        """
+        if self.outbox is None:
+            self._queue.put(self.from_email, to, msg, on_sent=on_sent, tracker=tracker)
+            return
+
+        # Once spooled the message is sent from the outbox file so it doesn't stay in memory while queued
+        message_id = self.outbox.put(self.from_email, to, msg)
+        if on_sent is not None:
+            on_sent()
+        if self.outbox.claim(message_id):
+            self._put_outbox(message_id, tracker)
+
+    def _put_outbox(self, message_id: str, tracker: Optional[Tracker] = None) -> None:
+        from_addr, to, f = self.outbox.open(message_id)
+
+        def on_sent():
+            f.close()
+            self.outbox.delivered(message_id)
+
+        def on_failed(e: Exception):
+            f.close()
+            self.outbox.failed(message_id, e)
+
+        self._queue.put(from_addr, to, f, on_sent=on_sent, on_failed=on_failed, tracker=tracker)
+
+    def flush_outbox(self, retry_interrupted: bool = False) -> Tuple[int, List[Tuple[List[str], Exception]]]:
+        """
+        Deliver messages still pending in the outbox
+        :param retry_interrupted: Also deliver messages whose delivery was cut short, which may already have been sent
+        :return: Number of messages attempted, and recipients and error of each that failed
+        """
+        if self.outbox is None:
+            raise Exception("No outbox configured")
+
+        if retry_interrupted:
+            for message_id in self.outbox.interrupted():
+                self.outbox.requeue(message_id)
+
+        count = 0
+        for message_id in self.outbox.pending():
+            if not self.outbox.claim(message_id):
+                continue
+            self._put_outbox(message_id)
+            count += 1
+
+        return count, self.drain()
+
+    def drain(self) -> List[Tuple[List[str], Exception]]:
+        """
+        Wait for every queued message to be sent
+        :return: Recipients and error of each queued message that failed, other than those queued with a tracker
+        """
+        return self._queue.drain()
+
+    def close(self) -> None:
+        """
+        Send any queued messages then close all SMTP sessions
+        """
+        for to, error in self._queue.close():
+            print("Failed sending email to {}: {}".format(", ".join(to), error))
+        self._connection.close()
+
+    def __enter__(self) -> "Manager":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
@@ -0,0 +1,218 @@
+"""
+Compile MJML email templates to HTML Jinja templates
+
+The MJML structure of an email is the same for every message, only the variables differ. Compiling a template once
+turns it into plain HTML with its Jinja tags preserved so that each message only needs a Jinja render.
+"""
+
+import hashlib
+import os
+import re
+import tempfile
+import threading
+from importlib import metadata
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import jinja2
+from mjml import mjml2html
+
+COMMENT_RE = re.compile(r"{#.*?#}", re.DOTALL)
+TAG_RE = re.compile(r"{{.*?}}|{%.*?%}", re.DOTALL)
+EXTENDS_RE = re.compile(r"{%-?\s*extends\s+[\"']([^\"']+)[\"']\s*-?%}")
+BLOCK_RE = re.compile(r"{%-?\s*(block\s+(\w+)|endblock(?:\s+\w+)?)\s*-?%}")
+# Tags that can't be flattened into a single template
+UNSUPPORTED_RE = re.compile(r"{%-?\s*(include|import|from|raw)\b|super\(\)")
+
+try:
+    MJML_VERSION = metadata.version("mjml-python")
+except metadata.PackageNotFoundError:
+    MJML_VERSION = ""
+
+
+class CompileError(Exception):
+    pass
+
+
+def _blocks(source: str) -> Dict[str, str]:
+    # Contents of each block in a template, including nested blocks
+    blocks = {}
+    stack = []
+    for m in BLOCK_RE.finditer(source):
+        if m.group(2):
+            stack.append((m.group(2), m.end()))
+        elif stack:
+            name, start = stack.pop()
+            blocks.setdefault(name, source[start:m.start()])
+    if stack:
+        raise CompileError("Unclosed block '{}'".format(stack[-1][0]))
+    return blocks
+
+
+def _replace_blocks(source: str, blocks: Dict[str, str]) -> str:
+    # Replace the outermost blocks in source with their overrides, recursing into blocks that are kept
+    out = []
+    pos = 0
+    depth = 0
+    start = None
+    name = None
+    for m in BLOCK_RE.finditer(source):
+        if m.group(2):
+            if depth == 0:
+                out.append(source[pos:m.start()])
+                name, start = m.group(2), m.end()
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                content = blocks[name] if name in blocks else source[start:m.start()]
+                out.append(_replace_blocks(content, blocks))
+                pos = m.end()
+    out.append(source[pos:])
+    return "".join(out)
+
+
+def flatten(loader: jinja2.BaseLoader, env: jinja2.Environment, name: str) -> str:
+    """
+    Resolve a template's extends chain into a single template without blocks
+    :param loader: Loader to read templates with
+    :param env: Environment the loader belongs to
+    :param name: Template name
+    :return: Flattened template source
+    """
+    source = COMMENT_RE.sub("", loader.get_source(env, name)[0])
+    if UNSUPPORTED_RE.search(source):
+        raise CompileError("Template '{}' uses tags that can't be precompiled".format(name))
+
+    blocks: Dict[str, str] = {}
+    while True:
+        m = EXTENDS_RE.search(source)
+        if not m:
+            break
+
+        # Blocks defined further down the chain take precedence
+        for block_name, content in _blocks(source).items():
+            blocks.setdefault(block_name, content)
+
+        source = COMMENT_RE.sub("", loader.get_source(env, m.group(1))[0])
+        if UNSUPPORTED_RE.search(source):
+            raise CompileError("Template '{}' uses tags that can't be precompiled".format(m.group(1)))
+
+    return _replace_blocks(source, blocks)
+
+
+def compile_mjml(source: str) -> str:
+    """
+    Compile a flattened MJML Jinja template into an HTML Jinja template
+    :param source: Flattened template source
+    :return: Compiled template source
+    """
+    # Hide the Jinja tags from MJML. Statements become comments so they survive between elements, expressions become
+    # plain text so they can sit in both text and attributes.
+    tags = []
+
+    def protect(m: re.Match) -> str:
+        tags.append(m.group(0))
+        marker = "srjinja{}x".format(len(tags) - 1)
+        return "<!--{}-->".format(marker) if m.group(0).startswith("{%") else marker
+
+    html = mjml2html(TAG_RE.sub(protect, source))
+
+    # Anything else that looks like Jinja in the output is literal
+    parts = []
+    pos = 0
+    for index, tag in enumerate(tags):
+        marker = "srjinja{}x".format(index)
+        comment = "<!--{}-->".format(marker)
+        found = html.find(comment, pos) if tag.startswith("{%") else -1
+        length = len(comment)
+        if found < 0:
+            found = html.find(marker, pos)
+            length = len(marker)
+        if found < 0:
+            raise CompileError("MJML moved or dropped the Jinja tag '{}'".format(tag))
+
+        parts.append(_literal(html[pos:found]))
+        parts.append(tag)
+        pos = found + length
+    parts.append(_literal(html[pos:]))
+
+    # The uncompiled template was not autoescaped so neither is the compiled one
+    return "{% autoescape false %}" + "".join(parts) + "{% endautoescape %}"
+
+
+def _literal(text: str) -> str:
+    if "{{" in text or "{%" in text or "{#" in text:
+        return "{% raw %}" + text + "{% endraw %}"
+    return text
+
+
+class MjmlRenderer(object):
+    """
+    Renders MJML email templates to HTML
+
+    When precompiling, each template is compiled once and kept on disk keyed by the hash of its flattened source.
+    Templates that can't be precompiled are compiled for every message instead.
+    """
+
+    def __init__(self, jinja: jinja2.Environment, precompile: bool = False, cache_path: Optional[Path] = None):
+        """
+        :param jinja: Environment to load and render templates with
+        :param precompile: Compile each template once instead of for every message
+        :param cache_path: Folder to keep compiled templates in. None keeps them in memory only
+        """
+        self.jinja = jinja
+        self.precompile = precompile
+        self.cache_path = Path(cache_path) if cache_path else None
+        self._compiled: Dict[str, Optional[jinja2.Template]] = {}
+        self._lock = threading.Lock()
+
+    def _load_compiled(self, name: str) -> Optional[jinja2.Template]:
+        try:
+            source = flatten(self.jinja.loader, self.jinja, name)
+        except CompileError:
+            return None
+
+        digest = hashlib.sha256((MJML_VERSION + "\0" + source).encode("utf-8")).hexdigest()
+        path = self.cache_path.joinpath("{}.html".format(digest)) if self.cache_path else None
+
+        if path and path.exists():
+            return self.jinja.from_string(path.read_text("utf-8"))
+
+        try:
+            compiled = compile_mjml(source)
+        except CompileError:
+            return None
+
+        if path:
+            # Write atomically so concurrent runs never read a partial file
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(compiled)
+            os.replace(tmp, path)
+
+        return self.jinja.from_string(compiled)
+
+    def compiled(self, name: str) -> Optional[jinja2.Template]:
+        """
+        Get the compiled form of a template, compiling it if needed
+        :param name: Template name
+        :return: Compiled template, or None if the template can't be precompiled
+        """
+        with self._lock:
+            if name not in self._compiled:
+                self._compiled[name] = self._load_compiled(name)
+            return self._compiled[name]
+
+    def render(self, name: str, args: Dict[str, Any]) -> str:
+        """
+        Render an MJML template to HTML
+        :param name: Template name
+        :param args: Template variables
+        :return: HTML
+        """
+        template = self.compiled(name) if self.precompile else None
+        if template is not None:
+            return template.render(**args)
+        return mjml2html(self.jinja.get_template(name).render(**args))
@@ -0,0 +1,195 @@
+import datetime
+import json
+import os
+import smtplib
+import socket
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import BinaryIO, List, Optional, Tuple
+
+from .dispatch import is_temporary
+from .stream import MessageSource, write_source
+
+
+class Outbox(object):
+    """
+    A Maildir-style spool of built messages waiting to be delivered
+
+    Messages are written to tmp/ then moved into new/ once complete. A message being delivered is claimed by moving it
+    into cur/ and flagged as seen (":2,S") once the server accepts it, or moved back into new/ if it fails. Messages the
+    server rejects outright (a 5xx reply) are left in cur/ flagged as trashed (":2,T") so they aren't retried. Each
+    event is appended to ledger.jsonl.
+
+    The envelope is kept at the top of each message file in X-Envelope-From and X-Envelope-To headers, which are
+    stripped again before delivery.
+    """
+
+    LEDGER = "ledger.jsonl"
+
+    def __init__(self, path: Path):
+        """
+        :param path: Folder of the spool
+        """
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._counter = 0
+
+        for folder in ("tmp", "new", "cur"):
+            self.path.joinpath(folder).mkdir(parents=True, exist_ok=True)
+
+    def _unique(self) -> str:
+        with self._lock:
+            self._counter += 1
+            counter = self._counter
+        host = socket.gethostname().replace("/", "\\057").replace(":", "\\072")
+        return "{}.P{}Q{}R{}.{}".format(int(time.time()), os.getpid(), counter, uuid.uuid4().hex[:8], host)
+
+    def _log(self, event: str, message_id: str, to: Optional[List[str]] = None, error: Optional[str] = None) -> None:
+        entry = {
+            "time": datetime.datetime.now().isoformat(timespec="seconds"),
+            "event": event,
+            "id": message_id,
+        }
+        if to is not None:
+            entry["to"] = to
+        if error is not None:
+            entry["error"] = error
+
+        with self._lock:
+            with open(self.path.joinpath(self.LEDGER), "a") as f:
+                f.write(json.dumps(entry) + "\n")
+
+    def put(self, from_addr: str, to_addrs: List[str], msg: MessageSource) -> str:
+        """
+        Spool a message
+        :param from_addr: Envelope sender
+        :param to_addrs: Envelope recipients
+        :param msg: Message
+        :return: ID of the spooled message
+        """
+        message_id = self._unique()
+        tmp = self.path.joinpath("tmp", message_id)
+        with open(tmp, "wb") as f:
+            f.write("X-Envelope-From: {}\n".format(from_addr).encode("utf-8"))
+            f.write("X-Envelope-To: {}\n".format(", ".join(to_addrs)).encode("utf-8"))
+            write_source(msg, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path.joinpath("new", message_id))
+
+        self._log("queued", message_id, to_addrs)
+        return message_id
+
+    def pending(self) -> List[str]:
+        """
+        IDs of messages waiting to be delivered, oldest first
+        """
+        return sorted(p.name for p in self.path.joinpath("new").iterdir())
+
+    def interrupted(self) -> List[str]:
+        """
+        IDs of messages that were claimed for delivery but never finished, such as when a run was killed
+        """
+        return sorted(
+            p.name[: -len(":2,")]
+            for p in self.path.joinpath("cur").iterdir()
+            if p.name.endswith(":2,")
+        )
+
+    def requeue(self, message_id: str) -> None:
+        """
+        Move an interrupted message back to pending
+        """
+        os.replace(
+            self.path.joinpath("cur", message_id + ":2,"),
+            self.path.joinpath("new", message_id),
+        )
+        self._log("requeued", message_id)
+
+    def claim(self, message_id: str) -> bool:
+        """
+        Claim a pending message for delivery
+        :param message_id: ID of the message
+        :return: False if the message was already claimed by someone else
+        """
+        try:
+            os.rename(
+                self.path.joinpath("new", message_id),
+                self.path.joinpath("cur", message_id + ":2,"),
+            )
+        except FileNotFoundError:
+            return False
+        return True
+
+    def open(self, message_id: str) -> Tuple[str, List[str], BinaryIO]:
+        """
+        Open a claimed message to deliver it
+        :param message_id: ID of the message
+        :return: Envelope sender, envelope recipients and the message file positioned after the envelope. The caller
+                 closes the file.
+        """
+        from_addr = ""
+        to_addrs: List[str] = []
+        f = open(self.path.joinpath("cur", message_id + ":2,"), "rb")
+        for _ in range(2):
+            name, _, value = f.readline().decode("utf-8").partition(":")
+            value = value.strip()
+            if name == "X-Envelope-From":
+                from_addr = value
+            elif name == "X-Envelope-To":
+                to_addrs = [t.strip() for t in value.split(",") if t.strip()]
+
+        return from_addr, to_addrs, f
+
+    def delivered(self, message_id: str) -> None:
+        """
+        Mark a claimed message as delivered
+        """
+        os.replace(
+            self.path.joinpath("cur", message_id + ":2,"),
+            self.path.joinpath("cur", message_id + ":2,S"),
+        )
+        self._log("delivered", message_id)
+
+    def failed(self, message_id: str, error: Exception) -> None:
+        """
+        Return a claimed message to pending after it failed to deliver, or set it aside if the server rejected it
+        outright so it is not retried
+        """
+        if isinstance(error, (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused)) and not is_temporary(error):
+            os.replace(
+                self.path.joinpath("cur", message_id + ":2,"),
+                self.path.joinpath("cur", message_id + ":2,T"),
+            )
+            self._log("rejected", message_id, error=str(error))
+            return
+
+        os.replace(
+            self.path.joinpath("cur", message_id + ":2,"),
+            self.path.joinpath("new", message_id),
+        )
+        self._log("failed", message_id, error=str(error))
+
+    def rejected(self) -> List[str]:
+        """
+        IDs of messages the server rejected outright
+        """
+        return sorted(
+            p.name[: -len(":2,T")]
+            for p in self.path.joinpath("cur").iterdir()
+            if p.name.endswith(":2,T")
+        )
+
+    def purge(self) -> int:
+        """
+        Delete delivered messages
+        :return: Number of messages deleted
+        """
+        count = 0
+        for p in self.path.joinpath("cur").iterdir():
+            if p.name.endswith(":2,S"):
+                p.unlink()
+                count += 1
+        return count
@@ -0,0 +1,78 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from email.mime.application import MIMEApplication
+from email.mime.audio import MIMEAudio
+from email.mime.image import MIMEImage
+from email.mime.nonmultipart import MIMENonMultipart
+from typing import Tuple
+
+from .attachment import AttachType, File
+
+
+def build_part(a: File, content: bytes, attachment: bool) -> MIMENonMultipart:
+    """
+    Encode a file into a MIME part
+    :param a: File
+    :param content: Contents of the file
+    :param attachment: Whether the part is an attachment rather than embedded
+    """
+    data: MIMENonMultipart
+    if a.typeof == AttachType.IMAGE:
+        data = MIMEImage(content)
+    elif a.typeof == AttachType.AUDIO:
+        data = MIMEAudio(content)
+    else:
+        data = MIMEApplication(content)
+
+    data.add_header("Content-ID", "<{}>".format(a.name))
+    if attachment:
+        data.add_header(
+            "Content-Disposition", 'attachment; filename="{}"'.format(a.name)
+        )
+    return data
+
+
+class PartCache(object):
+    """
+    Encoded MIME parts of files, so a file sent to several recipients is only encoded once
+
+    Parts are keyed by the file's name, type and content hash. The least recently used parts are dropped once more
+    than max_entries are held.
+    """
+
+    def __init__(self, max_entries: int = 32):
+        """
+        :param max_entries: Number of parts to keep
+        """
+        self.max_entries = max_entries
+        self._parts: OrderedDict[Tuple, MIMENonMultipart] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, a: File, attachment: bool = False) -> MIMENonMultipart:
+        """
+        Get the encoded part of a file, encoding it if not already held
+        :param a: File
+        :param attachment: Whether the part is an attachment rather than embedded
+        """
+        content = a.read()
+        key = (
+            a.name,
+            a.typeof,
+            attachment,
+            hashlib.sha256(content).digest(),
+        )
+
+        with self._lock:
+            part = self._parts.get(key)
+            if part is not None:
+                self._parts.move_to_end(key)
+                return part
+
+        part = build_part(a, content, attachment)
+
+        with self._lock:
+            self._parts[key] = part
+            while len(self._parts) > self.max_entries:
+                self._parts.popitem(last=False)
+        return part
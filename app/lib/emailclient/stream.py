@@ -0,0 +1,143 @@
+"""
+Serialize messages straight to their destination instead of building them as one string first
+"""
+
+import random
+import shutil
+import sys
+from email.message import Message
+from typing import BinaryIO, Union
+
+# A message to send. Either already serialized, a message to serialize while sending, or a file to stream it from
+MessageSource = Union[str, bytes, Message, BinaryIO]
+
+CRLF = b"\r\n"
+
+
+def _boundary() -> str:
+    # Same form as the boundaries email.generator makes
+    return "=" * 15 + "{:019d}".format(random.randrange(sys.maxsize)) + "=="
+
+
+def write_message(msg: Message, fp, chunk_size: int = 65536) -> None:
+    """
+    Serialize a message to a binary file object
+
+    Unlike email.generator, which builds each part in memory before writing it, parts are written as they are walked
+    and payloads are written in chunks, so the whole serialized message is never held at once. Parts are only read, so
+    parts shared between messages can be written by several threads at once.
+    :param msg: Message
+    :param fp: Object with a write(bytes) method
+    :param chunk_size: Characters of payload to write at a time
+    """
+    if msg.is_multipart() and msg.get_boundary() is None:
+        msg.set_boundary(_boundary())
+
+    # Headers are left unfolded like Message.as_string() does
+    policy = msg.policy.clone(max_line_length=0)
+    for name, value in msg.raw_items():
+        fp.write(policy.fold_binary(name, value))
+    fp.write(b"\n")
+
+    # Read the payload directly as email.generator does. get_payload() encodes the whole payload to check it first
+    payload = msg._payload
+    if msg.is_multipart():
+        boundary = msg.get_boundary().encode("ascii")
+        if msg.preamble is not None:
+            fp.write(msg.preamble.encode("utf-8") + b"\n")
+        fp.write(b"--" + boundary + b"\n")
+        for index, part in enumerate(payload):
+            if index:
+                fp.write(b"\n--" + boundary + b"\n")
+            write_message(part, fp, chunk_size)
+        fp.write(b"\n--" + boundary + b"--\n")
+        if msg.epilogue is not None:
+            fp.write(msg.epilogue.encode("utf-8"))
+    elif isinstance(payload, str):
+        # Payloads are already transfer encoded. Undecodable bytes were kept as surrogates
+        for start in range(0, len(payload), chunk_size):
+            fp.write(payload[start:start + chunk_size].encode("utf-8", "surrogateescape"))
+    elif payload is not None:
+        raise Exception("Can't stream a {} part".format(msg.get_content_type()))
+
+
+class DataWriter(object):
+    """
+    File-like object that writes a message to a socket in the SMTP DATA phase
+
+    Line endings are converted to CRLF and lines starting with a dot are escaped. Writes are buffered so the socket
+    sees large sends rather than one per line.
+    """
+
+    def __init__(self, sock, buffer_size: int = 65536):
+        """
+        :param sock: Socket to send to
+        :param buffer_size: Bytes to collect before sending
+        """
+        self.sock = sock
+        self.buffer_size = buffer_size
+        self._buffer = bytearray()
+        # Whether the next byte starts a line
+        self._bol = True
+        # Whether the last byte written was a CR, so a following LF belongs to the same line ending
+        self._cr = False
+
+    def write(self, data: bytes) -> int:
+        for line in data.splitlines(keepends=True):
+            if self._cr:
+                self._cr = False
+                if line.startswith(b"\n"):
+                    line = line[1:]
+                    if not line:
+                        continue
+
+            if self._bol and line.startswith(b"."):
+                self._buffer += b"."
+
+            if line.endswith(b"\r\n"):
+                self._buffer += line[:-2] + CRLF
+                self._bol = True
+            elif line.endswith(b"\n"):
+                self._buffer += line[:-1] + CRLF
+                self._bol = True
+            elif line.endswith(b"\r"):
+                self._buffer += line[:-1] + CRLF
+                self._bol = True
+                self._cr = True
+            else:
+                self._buffer += line
+                self._bol = False
+
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+        return len(data)
+
+    def flush(self) -> None:
+        if self._buffer:
+            self.sock.sendall(self._buffer)
+            self._buffer = bytearray()
+
+    def close(self) -> None:
+        """
+        Finish the message with the end of data marker
+        """
+        if not self._bol:
+            self._buffer += CRLF
+        self._buffer += b"." + CRLF
+        self.flush()
+
+
+def write_source(source: MessageSource, fp) -> None:
+    """
+    Write a message from any source to a binary file object
+    :param source: Message
+    :param fp: Object with a write(bytes) method
+    """
+    if isinstance(source, Message):
+        write_message(source, fp)
+    elif isinstance(source, str):
+        fp.write(source.encode("utf-8"))
+    elif isinstance(source, bytes):
+        fp.write(source)
+    else:
+        shutil.copyfileobj(source, fp, 65536)
@@ -0,0 +1,2 @@
+from .ledger import Checkpoint, Ledger
+from .shard import Shard
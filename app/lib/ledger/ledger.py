@@ -0,0 +1,179 @@
+import datetime
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Set
+
+from .shard import Shard
+
+
+class Ledger(object):
+    """
+    Record of the units of work each step of an action group has completed
+
+    Units are keyed by (group, step, period, unit) where a unit is whatever a step fans out over, such as a recipient
+    or a client. An interrupted run can then resume and skip the units already done.
+    """
+
+    def __init__(self, path: Path):
+        """
+        :param path: SQLite file to keep the ledger in
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        # Units are completed from the email dispatch threads so the connection is shared under a lock
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS units (
+                    action_group TEXT NOT NULL,
+                    step TEXT NOT NULL,
+                    period TEXT NOT NULL,
+                    unit TEXT NOT NULL,
+                    completed_at TEXT NOT NULL,
+                    PRIMARY KEY (action_group, step, period, unit)
+                )
+                """
+            )
+            # Fingerprint of the data each unit was last completed with, so a later run can tell whether it changed
+            self._db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS fingerprints (
+                    action_group TEXT NOT NULL,
+                    step TEXT NOT NULL,
+                    period TEXT NOT NULL,
+                    unit TEXT NOT NULL,
+                    fingerprint TEXT NOT NULL,
+                    PRIMARY KEY (action_group, step, period, unit)
+                )
+                """
+            )
+
+    def completed(self, group: str, step: str, period: str) -> Set[str]:
+        """
+        Units a step has completed for a period
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT unit FROM units WHERE action_group = ? AND step = ? AND period = ?",
+                (group, step, period),
+            ).fetchall()
+        return {r[0] for r in rows}
+
+    def fingerprints(self, group: str, step: str, period: str) -> Dict[str, str]:
+        """
+        Fingerprint each unit of a step was last completed with for a period
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT unit, fingerprint FROM fingerprints WHERE action_group = ? AND step = ? AND period = ?",
+                (group, step, period),
+            ).fetchall()
+        return {r[0]: r[1] for r in rows}
+
+    def complete(self, group: str, step: str, period: str, unit: str, fingerprint: Optional[str] = None) -> None:
+        """
+        Record a unit as completed
+        :param fingerprint: Fingerprint of the data the unit was completed with, if any
+        """
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO units VALUES (?, ?, ?, ?, ?)",
+                (group, step, period, unit, datetime.datetime.now().isoformat(timespec="seconds")),
+            )
+            if fingerprint is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?, ?)",
+                    (group, step, period, unit, fingerprint),
+                )
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class Checkpoint(object):
+    """
+    A step's view of the ledger
+
+    Completed units are always recorded. They are only skipped when resuming, so a normal run still does all the work
+    but leaves a record for a later resume.
+    """
+
+    def __init__(
+        self,
+        ledger: Ledger,
+        group: str,
+        step: str,
+        resume: bool = False,
+        shard: Optional[Shard] = None,
+        only_changed: bool = False,
+    ):
+        """
+        :param ledger: Ledger to record units in
+        :param group: Name of the action group
+        :param step: Identifies the step within the group
+        :param resume: Skip units already completed
+        :param shard: Only work on the entities in this shard. None works on all of them
+        :param only_changed: Skip units whose data has the same fingerprint as when they were last completed
+        """
+        self.ledger = ledger
+        self.group = group
+        self.step = step
+        self.resume = resume
+        self.shard = shard
+        self.only_changed = only_changed
+        self._completed: Dict[str, Set[str]] = {}
+        self._fingerprints: Dict[str, Dict[str, str]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def period(start: datetime.date, end: datetime.date) -> str:
+        """
+        Key of a reporting period
+        """
+        return "{}..{}".format(start.isoformat(), end.isoformat())
+
+    def _period_completed(self, period: str) -> Set[str]:
+        with self._lock:
+            if period not in self._completed:
+                self._completed[period] = (
+                    self.ledger.completed(self.group, self.step, period)
+                    if self.resume
+                    else set()
+                )
+            return self._completed[period]
+
+    def owns(self, entity: str) -> bool:
+        """
+        Whether this run works on an entity, such as a member or client, or leaves it to another shard
+        """
+        return self.shard is None or self.shard.owns(entity)
+
+    def done(self, period: str, unit: str) -> bool:
+        """
+        Whether a unit can be skipped because an earlier run completed it
+        """
+        return unit in self._period_completed(period)
+
+    def changed(self, period: str, unit: str, fingerprint: str) -> bool:
+        """
+        Whether a unit needs doing because its data changed since it was last completed. Always true unless only
+        changed units are being done
+        """
+        if not self.only_changed:
+            return True
+        with self._lock:
+            if period not in self._fingerprints:
+                self._fingerprints[period] = self.ledger.fingerprints(self.group, self.step, period)
+            return self._fingerprints[period].get(unit) != fingerprint
+
+    def complete(self, period: str, unit: str, fingerprint: Optional[str] = None) -> None:
+        """
+        Record a unit as completed
+        :param fingerprint: Fingerprint of the data the unit was completed with, for later runs to compare against
+        """
+        self.ledger.complete(self.group, self.step, period, unit, fingerprint)
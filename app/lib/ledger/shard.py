@@ -0,0 +1,42 @@
+import hashlib
+
+
+class Shard(object):
+    """
+    One of several disjoint parts that the entities of a run are divided into, so several nodes can share the work
+
+    Entities are assigned by a hash of their ID, so each always lands in the same shard no matter which node asks or
+    what else is in the run.
+    """
+
+    def __init__(self, index: int, count: int):
+        """
+        :param index: Which shard, counting from 1
+        :param count: Number of shards
+        """
+        if count < 1 or not 1 <= index <= count:
+            raise Exception("Shard {}/{} is out of range".format(index, count))
+        self.index = index
+        self.count = count
+
+    @classmethod
+    def parse(cls, value: str) -> "Shard":
+        """
+        Read a shard written as "i/n", such as "2/4"
+        """
+        try:
+            index, count = (int(v) for v in value.split("/"))
+        except ValueError:
+            raise Exception("Shard '{}' should be written as i/n, such as 2/4".format(value))
+        return cls(index, count)
+
+    def owns(self, key: str) -> bool:
+        """
+        Whether an entity belongs to this shard
+        :param key: ID of the entity
+        """
+        digest = hashlib.sha256(key.encode("utf-8")).digest()
+        return int.from_bytes(digest[:8], "big") % self.count == self.index - 1
+
+    def __str__(self) -> str:
+        return "{}/{}".format(self.index, self.count)
@@ -0,0 +1,95 @@
+import contextvars
+import queue
+import threading
+from typing import Any, Callable, Iterable, List, NamedTuple, Tuple
+
+# Tells a worker there are no more items
+_DONE = object()
+
+
+class Stage(NamedTuple):
+    name: str
+    # Takes the item from the previous stage and returns the item for the next. Returning None drops the item
+    run: Callable[[Any], Any]
+    # Number of items worked on at once
+    workers: int = 1
+
+
+class Pipeline(object):
+    """
+    Passes items through a series of stages, each with its own pool of worker threads
+
+    Stages are joined by bounded queues, so a slow stage holds back the stages before it rather than letting work pile
+    up in memory. With every stage busy at once, a run takes about as long as its slowest stage.
+
+    An item that raises an error in a stage goes no further. The error is collected and the other items carry on.
+    """
+
+    def __init__(self, stages: List[Stage]):
+        """
+        :param stages: Stages in the order items pass through them
+        """
+        self.stages = stages
+
+    def run(self, items: Iterable[Any]) -> List[Tuple[Any, str, Exception]]:
+        """
+        Pass items through every stage, returning once all of them are finished with
+        :param items: Items for the first stage. Read as the first stage is ready for them
+        :return: The original item, stage name and error for each item that failed
+        """
+        queues = [queue.Queue(maxsize=max(s.workers, 1) * 2) for s in self.stages]
+        failures: List[Tuple[Any, str, Exception]] = []
+        lock = threading.Lock()
+        # Workers still running in each stage. The last to finish tells the next stage there is nothing more to come
+        running = [max(s.workers, 1) for s in self.stages]
+
+        def work(index: int) -> None:
+            stage = self.stages[index]
+            while True:
+                entry = queues[index].get()
+                if entry is _DONE:
+                    break
+
+                # Items travel with the original item so failures can be reported against it
+                origin, item = entry
+                try:
+                    result = stage.run(item)
+                except Exception as e:
+                    with lock:
+                        failures.append((origin, stage.name, e))
+                    continue
+                if result is not None and index + 1 < len(self.stages):
+                    queues[index + 1].put((origin, result))
+
+            with lock:
+                running[index] -= 1
+                last = running[index] == 0
+            if last and index + 1 < len(self.stages):
+                for _ in range(running[index + 1]):
+                    queues[index + 1].put(_DONE)
+
+        # Workers run in a copy of the caller's context, so they write into any output the caller is capturing
+        context = contextvars.copy_context()
+        threads = [
+            threading.Thread(
+                target=context.copy().run,
+                args=(work, index),
+                name="pipeline-{}-{}".format(s.name, n),
+                daemon=True,
+            )
+            for index, s in enumerate(self.stages)
+            for n in range(max(s.workers, 1))
+        ]
+        for thread in threads:
+            thread.start()
+
+        try:
+            for item in items:
+                queues[0].put((item, item))
+        finally:
+            for _ in range(running[0]):
+                queues[0].put(_DONE)
+
+        for thread in threads:
+            thread.join()
+        return failures
@@ -0,0 +1 @@
+from .cron import Cron
@@ -0,0 +1,101 @@
+import datetime
+from typing import List, Set
+
+# Shorthands for common schedules
+ALIASES = {
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+    "@monthly": "0 0 1 * *",
+    "@weekly": "0 0 * * 0",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@hourly": "0 * * * *",
+}
+
+MONTHS = ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"]
+DAYS = ["sun", "mon", "tue", "wed", "thu", "fri", "sat"]
+
+
+def _field(value: str, low: int, high: int, names: List[str] = None) -> Set[int]:
+    # Parse one field of a cron expression, such as "*/15", "1-5" or "mon,wed,fri", into the values it matches
+    def number(s: str) -> int:
+        if names and s.lower() in names:
+            return names.index(s.lower()) + (1 if low == 1 else 0)
+        n = int(s)
+        if not low <= n <= high:
+            raise ValueError("{} is not between {} and {}".format(n, low, high))
+        return n
+
+    values = set()
+    for part in value.split(","):
+        part, _, step = part.partition("/")
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start, end = (number(p) for p in part.split("-", 1))
+        else:
+            start = end = number(part)
+            if step:
+                end = high
+        values.update(range(start, end + 1, int(step) if step else 1))
+    return values
+
+
+class Cron(object):
+    """
+    A cron schedule: minute, hour, day of month, month and day of week
+
+    As in cron, when both the day of month and day of week are restricted a day matching either is due.
+    """
+
+    def __init__(self, expression: str):
+        """
+        :param expression: Five fields such as "0 6 * * mon", or an alias such as "@daily"
+        """
+        self.expression = expression
+        fields = ALIASES.get(expression.strip(), expression).split()
+        if len(fields) != 5:
+            raise Exception("Cron schedule '{}' should have 5 fields".format(expression))
+
+        try:
+            self.minutes = _field(fields[0], 0, 59)
+            self.hours = _field(fields[1], 0, 23)
+            self.days = _field(fields[2], 1, 31)
+            self.months = _field(fields[3], 1, 12, MONTHS)
+            # 7 is also Sunday
+            self.weekdays = {d % 7 for d in _field(fields[4], 0, 7, DAYS)}
+        except ValueError as e:
+            raise Exception("Invalid cron schedule '{}': {}".format(expression, e))
+
+        self._any_day = fields[2] == "*"
+        self._any_weekday = fields[4] == "*"
+
+    def _day_matches(self, date: datetime.date) -> bool:
+        day = date.day in self.days
+        # isoweekday() counts Monday as 1 through Sunday as 7
+        weekday = date.isoweekday() % 7 in self.weekdays
+        if self._any_day or self._any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def next(self, after: datetime.datetime) -> datetime.datetime:
+        """
+        The first time the schedule is due after a time
+        """
+        time = after.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+
+        # Look no further than a few years ahead so a schedule that can never be due (such as 31 February) ends
+        limit = time + datetime.timedelta(days=366 * 5)
+        while time < limit:
+            if time.month not in self.months or not self._day_matches(time.date()):
+                time = datetime.datetime.combine(time.date() + datetime.timedelta(days=1), datetime.time())
+                continue
+            if time.hour not in self.hours:
+                time = time.replace(minute=0) + datetime.timedelta(hours=1)
+                continue
+            if time.minute not in self.minutes:
+                time += datetime.timedelta(minutes=1)
+                continue
+            return time
+
+        raise Exception("Cron schedule '{}' is never due".format(self.expression))
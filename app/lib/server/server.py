@@ -0,0 +1,102 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Dict, Optional
+
+
+class PooledHTTPServer(HTTPServer):
+    """
+    HTTP server handling requests in a fixed pool of worker threads
+
+    Requests wait for a free worker. Once more than workers + backlog requests are in hand, new ones are turned away
+    straight away with a 503 rather than queueing without limit.
+    """
+
+    def __init__(self, address, handler, workers: int = 4, backlog: int = 16):
+        """
+        :param address: (host, port) to listen on
+        :param handler: Request handler class
+        :param workers: Number of requests handled at once
+        :param backlog: Number of requests that can wait for a worker
+        """
+        super().__init__(address, handler)
+        self._executor = ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="serve")
+        self._slots = threading.BoundedSemaphore(max(workers, 1) + max(backlog, 0))
+
+    def process_request(self, request, client_address) -> None:
+        if not self._slots.acquire(blocking=False):
+            try:
+                request.sendall(
+                    b"HTTP/1.1 503 Service Unavailable\r\n"
+                    b"Retry-After: 5\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
+                )
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+
+        self._executor.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address) -> None:
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def server_close(self) -> None:
+        super().server_close()
+        self._executor.shutdown(wait=True)
+
+
+class ChunkedWriter(object):
+    """
+    File-like object writing a response body with chunked transfer encoding as it is produced
+
+    The status and headers are only sent on the first write, so a handler can still send an error response if it
+    fails before producing anything.
+    """
+
+    def __init__(self, handler: BaseHTTPRequestHandler, headers: Optional[Dict[str, str]] = None, chunk_size: int = 65536):
+        """
+        :param handler: Handler of the request being responded to. Its protocol_version must be HTTP/1.1
+        :param headers: Headers to send with a 200 response
+        :param chunk_size: Largest chunk to send at once
+        """
+        self.handler = handler
+        self.headers = headers or {}
+        self.chunk_size = chunk_size
+        self.started = False
+
+    def write(self, data: bytes) -> int:
+        if not data:
+            return 0
+
+        if not self.started:
+            self.started = True
+            self.handler.send_response(200)
+            for name, value in self.headers.items():
+                self.handler.send_header(name, value)
+            self.handler.send_header("Transfer-Encoding", "chunked")
+            self.handler.end_headers()
+
+        view = memoryview(data)
+        for start in range(0, len(view), self.chunk_size):
+            chunk = view[start:start + self.chunk_size]
+            self.handler.wfile.write(b"%X\r\n" % len(chunk))
+            self.handler.wfile.write(chunk)
+            self.handler.wfile.write(b"\r\n")
+        return len(data)
+
+    def flush(self) -> None:
+        self.handler.wfile.flush()
+
+    def close(self) -> None:
+        """
+        Finish the body
+        """
+        if self.started:
+            self.handler.wfile.write(b"0\r\n\r\n")
+            self.handler.wfile.flush()
@@ -0,0 +1 @@
+from .singleflight import SingleFlight
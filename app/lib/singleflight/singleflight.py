@@ -0,0 +1,55 @@
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class _Call(object):
+    # A call in flight, shared with every caller asking for the same key while it runs
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight(object):
+    """
+    Runs a function once for concurrent calls with the same key
+
+    The first caller for a key runs the function. Callers with the same key arriving while it runs wait for it and
+    receive the same result, or the same error. Nothing is kept once the call finishes, so a later call runs again.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """
+        Run fn, or wait for the call already running for key
+        :param key: Identifies calls that would give the same result
+        :param fn: Called with no arguments
+        :return: Result of fn
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result
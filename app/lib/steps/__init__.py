@@ -0,0 +1,2 @@
+from .output import GroupedOutput
+from .runner import Step, run_steps
@@ -0,0 +1,91 @@
+import contextvars
+import threading
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, TextIO
+
+
+class _Capture(object):
+    # Output held back by one capture() until it ends
+    def __init__(self, parent: Optional["_Capture"]):
+        self.parent = parent
+        self.parts: List[str] = []
+        self.closed = False
+
+
+class GroupedOutput(object):
+    """
+    Stands in for stdout while steps run at once, so the output of each step is written together rather than
+    interleaved with the others
+
+    Whatever is written inside capture() is held back until the capture ends. The capture follows the context rather
+    than the thread, so threads started with the capturing context (see contextvars.copy_context()), such as pipeline
+    stages and email dispatch, write into it as well. A capture started within another is written into the outer one
+    when it ends. Anything else goes straight through.
+
+    Writes are collected a line at a time for each thread, so lines written at once by several threads are never mixed.
+    """
+
+    def __init__(self, stream: TextIO):
+        """
+        :param stream: Stream output is eventually written to
+        """
+        self.stream = stream
+        self._capture: contextvars.ContextVar[Optional[_Capture]] = contextvars.ContextVar(
+            "grouped_output_capture", default=None
+        )
+        # Start of a line each thread is part way through writing
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def capture(self) -> Iterator[None]:
+        """
+        Hold back output written in this context until the block finishes
+        """
+        capture = _Capture(self._capture.get())
+        token = self._capture.set(capture)
+        try:
+            yield
+        finally:
+            self._flush_line()
+            self._capture.reset(token)
+            with self._lock:
+                capture.closed = True
+                self._emit(capture.parent, "".join(capture.parts))
+                if capture.parent is None or capture.parent.closed:
+                    self.stream.flush()
+
+    def _emit(self, capture: Optional[_Capture], s: str) -> None:
+        # Write to the innermost capture still open, or the stream if there is none. Called holding the lock
+        while capture is not None and capture.closed:
+            capture = capture.parent
+        if capture is not None:
+            capture.parts.append(s)
+        else:
+            self.stream.write(s)
+
+    def _flush_line(self) -> None:
+        # Write out whatever this thread left without a newline
+        line = getattr(self._local, "line", "")
+        if line:
+            self._local.line = ""
+            with self._lock:
+                self._emit(self._capture.get(), line)
+
+    def write(self, s: str) -> int:
+        line = getattr(self._local, "line", "") + s
+        complete, newline, rest = line.rpartition("\n")
+        self._local.line = rest
+        if newline:
+            with self._lock:
+                self._emit(self._capture.get(), complete + newline)
+        return len(s)
+
+    def flush(self) -> None:
+        self._flush_line()
+        if self._capture.get() is None:
+            with self._lock:
+                self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
@@ -0,0 +1,89 @@
+import contextvars
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, NamedTuple, Optional, Set
+
+
+class Step(NamedTuple):
+    # Unique within the steps being run
+    key: str
+    # Keys of the steps that must succeed before this one starts
+    depends_on: List[str]
+    run: Callable[[], None]
+
+
+def run_steps(
+    steps: List[Step],
+    workers: int = 1,
+    on_skipped: Optional[Callable[[Step], None]] = None,
+) -> Dict[str, Exception]:
+    """
+    Run steps in a pool of threads, starting each once the steps it depends on have succeeded
+
+    Steps that are ready are started in the order given, so with one worker they run one after another in that order.
+    A step that fails doesn't stop the others, but the steps depending on it are skipped.
+    :param steps: Steps to run
+    :param workers: Number of steps run at once
+    :param on_skipped: Called with each step skipped because a step it depends on failed or was skipped
+    :return: Error of each step that failed, by key
+    """
+    keys = {s.key for s in steps}
+    for s in steps:
+        for d in s.depends_on:
+            if d not in keys:
+                raise Exception(f"Step '{s.key}' depends on unknown step '{d}'")
+    _check_cycles(steps)
+
+    workers = max(workers, 1)
+    pending = list(steps)
+    succeeded: Set[str] = set()
+    # Steps that failed or were skipped
+    failed: Dict[str, Optional[Exception]] = {}
+    running: Dict[Future, Step] = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while pending or running:
+            # Skip anything that can no longer run then start whatever is ready, up to the worker limit
+            for s in list(pending):
+                if any(d in failed for d in s.depends_on):
+                    pending.remove(s)
+                    failed[s.key] = None
+                    if on_skipped is not None:
+                        on_skipped(s)
+                elif len(running) < workers and all(d in succeeded for d in s.depends_on):
+                    pending.remove(s)
+                    # Steps run in the context they were started from, so output captured around run_steps() follows
+                    # them into the pool
+                    running[executor.submit(contextvars.copy_context().run, s.run)] = s
+
+            if not running:
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                s = running.pop(future)
+                error = future.exception()
+                if error is None:
+                    succeeded.add(s.key)
+                else:
+                    failed[s.key] = error
+
+    return {k: e for k, e in failed.items() if e is not None}
+
+
+def _check_cycles(steps: List[Step]) -> None:
+    depends_on = {s.key: s.depends_on for s in steps}
+    # 1 while a step's dependencies are being visited, 2 once they all check out
+    state: Dict[str, int] = {}
+
+    def visit(key: str, path: List[str]) -> None:
+        if state.get(key) == 2:
+            return
+        if state.get(key) == 1:
+            raise Exception("Steps depend on each other: {}".format(" -> ".join(path + [key])))
+        state[key] = 1
+        for d in depends_on[key]:
+            visit(d, path + [key])
+        state[key] = 2
+
+    for s in steps:
+        visit(s.key, [])
@@ -1,5 +1,5 @@
 from pathlib import Path
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Literal
 
 from pydantic import BaseModel, ConfigDict
 
@@ -15,6 +15,27 @@ class Gotenberg(BaseModel):
     uri: str = "http://127.0.0.1:3000"
 
 
+class Cache(BaseModel):
+    enabled: bool = True
+    # Maximum size of the PDF cache in megabytes. None is unlimited
+    size_limit: int | None = 500
+
+
+class Chunk(BaseModel):
+    # Split the detail of reports with more than this many members/projects into parts which are converted
+    # separately then merged. None never splits
+    size: int | None = None
+    # Number of parts converted at once
+    workers: int = 4
+
+
+class Resources(BaseModel):
+    # Resources up to this many bytes are inlined into reports as data URIs instead of being uploaded. 0 never inlines
+    inline_max_size: int = 0
+    # Downsample image resources larger than this many pixels on their longest side. None never downsamples
+    image_max_size: int | None = None
+
+
 class Email(BaseModel):
     host: str
     port: int = 587
@@ -22,20 +43,101 @@ class Email(BaseModel):
     password: str | None = None
     from_name: str | None = None
     from_email: str | None = None
+    # Reconnect to the server after sending this many messages over one connection. None never reconnects
+    max_messages_per_connection: int | None = 50
+    # Compile MJML templates to HTML once and cache them instead of compiling for every message
+    precompile_templates: bool = False
+    # Number of SMTP connections sending queued emails at once
+    workers: int = 1
+    # Limit how many emails are sent per second across all connections. None is unlimited
+    messages_per_second: float | None = None
+    # Times to retry an email the server temporarily rejects (4xx), waiting retry_backoff seconds then doubling
+    retries: int = 3
+    retry_backoff: float = 2.0
+    # Spool emails to <sr_data>/outbox before sending so any that fail can be sent later with flush-outbox
+    outbox: bool = False
+
+
+class Pipeline(BaseModel):
+    # Number of reports worked on at once in each stage of actions sending a report per member or client: querying and
+    # aggregating the data, rendering the HTML, converting it into a PDF and building the email to queue
+    aggregate: int = 1
+    render: int = 1
+    convert: int = 2
+    send: int = 1
+
+
+class Steps(BaseModel):
+    # Number of steps of an action group run at once. Steps wait for the steps named in their depends_on
+    workers: int = 1
+
+
+class Organizations(BaseModel):
+    # Number of organizations generate and action work on at once when run for several. Each organization's own steps
+    # and reports are still limited as for a single organization
+    workers: int = 1
+
+
+class Batch(BaseModel):
+    # Number of reports generate-batch renders and converts at once
+    workers: int = 2
 
 
 class Action(BaseModel):
     description: str | None = None
     action: str
+    # Name other steps in the group can list in depends_on
+    id: str | None = None
+    # ids of steps that must succeed before this one starts. Steps that don't depend on each other may run at once
+    depends_on: List[str] = []
     model_config = ConfigDict(extra="allow")
 
 
+class Schedule(BaseModel):
+    # When to run, as a cron expression (minute hour day-of-month month day-of-week) such as "0 6 1 * *"
+    cron: str
+    # Action group to run
+    action: str
+    # Variables passed to the group as with --var. {today}, {yesterday}, {week_start}, {last_week_start},
+    # {last_week_end}, {month_start}, {last_month_start} and {last_month_end} are replaced with dates relative to the run
+    var: Dict[str, str] = {}
+
+
+class ServeKey(BaseModel):
+    key: str
+    # Only allow staff_times for this member (user id) with this key. None allows any report
+    member_id: str | None = None
+
+
+class Serve(BaseModel):
+    host: str = "0.0.0.0"
+    port: int = 8080
+    # Number of reports generated at once
+    workers: int = 4
+    # Number of requests that can wait for a worker before more are turned away
+    backlog: int = 16
+    # Requests must send one of these as "Authorization: Bearer <key>". No keys lets anyone generate any report
+    keys: List[ServeKey] = []
+
+
 class Config(BaseModel):
     defaults: Dict[str, Any] = {}
     db: Db
     email: Email | None = None
+    # Backend used to render PDFs. Either `gotenberg` or `weasyprint`
+    renderer: Literal["gotenberg", "weasyprint"] = "gotenberg"
     gotenberg: Gotenberg = Gotenberg()
+    cache: Cache = Cache()
+    chunk: Chunk = Chunk()
+    resources: Resources = Resources()
+    steps: Steps = Steps()
+    organizations: Organizations = Organizations()
+    batch: Batch = Batch()
     actions: Dict[str, List[Action]] = {}
+    # Action groups run by serve-scheduler
+    schedules: List[Schedule] = []
+    # HTTP service started by serve
+    serve: Serve = Serve()
 
     # Location for output, additional templates, resources
     sr_data: Path = Path(".")
@@ -0,0 +1,37 @@
+import datetime
+from typing import Any, Dict, List, Literal
+
+from pydantic import BaseModel
+
+
+class ManifestReport(BaseModel):
+    # Report to generate
+    report: Literal["staff_times", "client_times"]
+    # Output file under sr-data. {start}, {end}, {period}, {organization_id} and the filters below are filled in for
+    # each file written (Default: <report>-{period}.<format>)
+    output: str | None = None
+    # Output format, as for generate
+    format: str = "pdf"
+    start: datetime.date | None = None
+    end: datetime.date | None = None
+    # Write a file for each week (Monday to Sunday) or calendar month between start and end instead of one for the
+    # whole range
+    split_by: Literal["week", "month"] | None = None
+    organization_id: str | None = None
+    template: str | None = None
+    footer_template: str | None = None
+    project_filter: str | None = None
+    member_filter: str | None = None
+    client_filter: str | None = None
+    # staff_times only
+    member_id_filter: str | None = None
+    # client_times only
+    client_id: str | None = None
+    # Resources readable by the template ([name:]file), added to those in the config defaults
+    resource: List[str] = []
+
+
+class Manifest(BaseModel):
+    # Settings applied to every report that doesn't set its own
+    defaults: Dict[str, Any] = {}
+    reports: List[Dict[str, Any]] = []
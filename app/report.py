@@ -17,10 +17,13 @@ from models.config import Config
 @click.pass_context
 def cli(ctx, config, sr_data):
     # Try load config
-    cfg = load_config([Path(config), Path(sr_data).joinpath(config)], None, Config)
+    paths = [Path(config), Path(sr_data).joinpath(config)]
+    cfg = load_config(paths, None, Config)
     cfg.sr_data = Path(sr_data)
     ctx.ensure_object(dict)
     ctx.obj["config"] = cfg
+    # Kept so long running commands can reload the config when it changes
+    ctx.obj["config_paths"] = paths
 
 
 if __name__ == "__main__":
@@ -1 +1 @@
-from .client_times import generate, report
+from .client_times import generate, load, records, render, report
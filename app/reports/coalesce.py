@@ -0,0 +1,138 @@
+"""
+Share the work of identical reports requested at the same time
+"""
+
+import contextvars
+import io
+import threading
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Dict, Hashable, List, Optional
+
+
+def _freeze(value: Any) -> Any:
+    # Hashable form of report arguments
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, Path):
+        return str(value)
+    return value
+
+
+class _Shared(object):
+    """
+    PDF of a report being generated, read by every request sharing it as it is written
+    """
+
+    def __init__(self):
+        self.data: Any = None
+        self.error: Optional[BaseException] = None
+        self._chunks: List[bytes] = []
+        self._finished = False
+        self._changed = threading.Condition()
+
+    def write(self, b: bytes) -> int:
+        with self._changed:
+            self._chunks.append(bytes(b))
+            self._changed.notify_all()
+        return len(b)
+
+    def finish(self, data: Any = None, error: Optional[BaseException] = None) -> None:
+        with self._changed:
+            self.data = data
+            self.error = error
+            self._finished = True
+            self._changed.notify_all()
+
+    def copy_to(self, output: BinaryIO, chunk_size: int) -> None:
+        """
+        Write the PDF to output in pieces of up to chunk_size as it becomes available, until the report finishes
+        """
+        index = 0
+        while True:
+            with self._changed:
+                self._changed.wait_for(lambda: index < len(self._chunks) or self._finished)
+                chunks = self._chunks[index:]
+                index = len(self._chunks)
+                finished = self._finished
+            for chunk in chunks:
+                view = memoryview(chunk)
+                for start in range(0, len(view), chunk_size):
+                    output.write(view[start:start + chunk_size])
+            if finished and not chunks:
+                return
+
+
+class Coalescer(object):
+    """
+    Generates reports so that identical requests made while one is already being generated share its data and PDF,
+    rather than each querying and converting the same report again. Each request is sent the PDF as it is written
+    """
+
+    def __init__(self, chunk_size: int = 65536):
+        """
+        :param chunk_size: Largest piece of the PDF written to an output at once
+        """
+        self.chunk_size = chunk_size
+        self._reports: Dict[Hashable, _Shared] = {}
+        self._lock = threading.Lock()
+
+    def report(
+        self,
+        report: Callable,
+        db,
+        env,
+        converter,
+        output: Path | str | BinaryIO,
+        **kwargs,
+    ):
+        """
+        Generate a report, sharing the work with an identical report already in progress
+        :param report: report() function of a report
+        :param output: File name or binary file object to write the PDF to
+        :param kwargs: Arguments to the report function
+        :return: Report data
+        """
+        # Only PDFs are shared. Other formats are written straight to a file
+        if kwargs.get("format", "pdf") != "pdf" or kwargs.get("debug"):
+            return report(db, env, converter, output=output, **kwargs)
+
+        key = (report.__module__, _freeze(kwargs))
+        with self._lock:
+            shared = self._reports.get(key)
+            leader = shared is None
+            if leader:
+                shared = self._reports[key] = _Shared()
+
+        if leader:
+            # The report is generated on its own thread so this request is sent the PDF as it is written, the same as
+            # the requests sharing it
+            threading.Thread(
+                target=contextvars.copy_context().run,
+                args=(self._generate, key, shared, report, db, env, converter, kwargs),
+            ).start()
+
+        if hasattr(output, "write"):
+            shared.copy_to(output, self.chunk_size)
+        else:
+            # Files are only written once the report is known to have succeeded
+            pdf = io.BytesIO()
+            shared.copy_to(pdf, self.chunk_size)
+            if shared.error is None and shared.data is not None:
+                Path(output).write_bytes(pdf.getvalue())
+
+        if shared.error is not None:
+            raise shared.error
+        return shared.data
+
+    def _generate(self, key: Hashable, shared: _Shared, report: Callable, db, env, converter, kwargs) -> None:
+        try:
+            data = report(db, env, converter, output=shared, **kwargs)
+        except BaseException as e:
+            shared.finish(error=e)
+        else:
+            shared.finish(data)
+        finally:
+            with self._lock:
+                del self._reports[key]
@@ -0,0 +1,334 @@
+"""
+Time entries fetched for reports, and a cache letting later reports in a run reuse them
+"""
+
+import datetime
+import hashlib
+import re
+import threading
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from psycopg2.extras import NamedTupleCursor
+
+from lib.singleflight import SingleFlight
+
+# Filters reports can apply to time entries. Name filters are partial matches, the rest exact
+NAME_FILTERS = {
+    "client": "client_name",
+    "project": "project_name",
+    "member": "user_name",
+}
+ID_FILTERS = {
+    "client_id": "client_id",
+    "member_id": "user_id",
+}
+
+
+def fetch(
+    db,
+    organization_id: str | List[str],
+    start: datetime.date,
+    end: datetime.date,
+    filters: Dict[str, Any],
+) -> List[Any]:
+    """
+    Query the time entries of an organization started within a period
+    :param db: Database
+    :param organization_id: Organization, or a list of organizations to fetch together
+    :param start: First day of period
+    :param end: Last day of period
+    :param filters: Keys of NAME_FILTERS or ID_FILTERS mapped to the value to filter by. A client_id of None matches
+                    time entries without a client
+    :return: Rows
+    """
+    # Several organizations are fetched together with one array parameter
+    organization = (
+        "te.organization_id = ANY(%(organization_id)s::uuid[])"
+        if isinstance(organization_id, list)
+        else "te.organization_id = %(organization_id)s"
+    )
+
+    where = []
+    if "client_id" in filters:
+        where.append("AND clients.id = %(client_id)s" if filters["client_id"] else "AND clients.id is null")
+    if filters.get("client"):
+        where.append("AND clients.name ilike %(client)s")
+    if filters.get("project"):
+        where.append("AND projects.name ilike %(project)s")
+    if filters.get("member"):
+        where.append("AND users.name ilike %(member)s")
+    if filters.get("member_id"):
+        where.append("AND users.id = %(member_id)s")
+
+    with db.cursor(cursor_factory=NamedTupleCursor) as cursor:
+        sql = f"""
+            SELECT te.organization_id, te.start, te.end, te.description, te.updated_at,
+                 users.id as user_id, users.name as user_name,
+                 clients.id as client_id, clients.name as client_name,
+                 projects.id as project_id, projects.name as project_name, projects.billable_rate as project_billable_rate,
+                 te.billable_rate, te.billable, organizations.billable_rate as organization_billable_rate
+            FROM users JOIN members ON (members.user_id = users.id)
+                 JOIN time_entries te ON (te.member_id = members.id)
+                 LEFT JOIN projects ON (te.project_id = projects.id)
+                 LEFT JOIN clients ON (te.client_id = clients.id)
+                 JOIN organizations ON (te.organization_id = organizations.id)
+            WHERE {organization}
+                AND te.start >= %(start)s
+                AND te.start < %(end)s
+                {" ".join(where)}
+              """
+
+        cursor.execute(
+            sql,
+            {
+                "organization_id": organization_id,
+                "start": start.isoformat(),
+                "end": (end + datetime.timedelta(days=1)).isoformat(),
+                "client_id": filters.get("client_id"),
+                "client": "%{}%".format(filters.get("client")),
+                "project": "%{}%".format(filters.get("project")),
+                "member": "%{}%".format(filters.get("member")),
+                "member_id": filters.get("member_id"),
+            },
+        )
+        return cursor.fetchall()
+
+
+def fingerprint(rows: List[Any]) -> str:
+    """
+    Fingerprint of time entries, changing whenever one is added, removed or edited
+    :param rows: Rows from fetch()
+    :return: Number of rows, latest updated_at and a hash of the rows
+    """
+    digest = hashlib.sha256()
+    # Rows are hashed in a fixed order so the same entries always give the same fingerprint
+    for line in sorted(repr(tuple(r)) for r in rows):
+        digest.update(line.encode("utf-8"))
+        digest.update(b"\n")
+    updated_at = max((r.updated_at for r in rows if r.updated_at is not None), default=None)
+    return "{}:{}:{}".format(
+        len(rows), updated_at.isoformat() if updated_at is not None else "", digest.hexdigest()
+    )
+
+
+def _ilike(pattern: str) -> re.Pattern:
+    # Regex equivalent of "ilike %pattern%"
+    regex = ""
+    escaped = False
+    for c in "%{}%".format(pattern):
+        if escaped:
+            regex += re.escape(c)
+            escaped = False
+        elif c == "\\":
+            escaped = True
+        elif c == "%":
+            regex += ".*"
+        elif c == "_":
+            regex += "."
+        else:
+            regex += re.escape(c)
+    return re.compile(regex, re.IGNORECASE | re.DOTALL)
+
+
+def normalize(filters: Dict[str, Any]) -> Tuple:
+    """
+    Hashable form of filters, dropping those that don't filter anything
+    """
+    return tuple(
+        sorted(
+            (k, str(v) if v else None)
+            for k, v in filters.items()
+            if k == "client_id" or v
+        )
+    )
+
+
+class Dataset(object):
+    """
+    Time entries fetched for an organization, period and set of filters
+    """
+
+    def __init__(self, organization_id: str, start: datetime.date, end: datetime.date, filters: Tuple, rows: List[Any]):
+        self.organization_id = str(organization_id)
+        self.start = start
+        self.end = end
+        self.filters = filters
+        self.rows = rows
+        self._index: Dict[str, Dict[Optional[str], List[Any]]] = {}
+        self._lock = threading.Lock()
+
+    def covers(self, organization_id: str, start: datetime.date, end: datetime.date, filters: Tuple) -> bool:
+        """
+        Whether this dataset holds every row matching a query
+        """
+        return (
+            self.organization_id == str(organization_id)
+            and self.start <= start
+            and end <= self.end
+            and set(self.filters) <= set(filters)
+        )
+
+    def _partition(self, column: str) -> Dict[Optional[str], List[Any]]:
+        # Rows grouped by an ID column, built on first use
+        with self._lock:
+            if column not in self._index:
+                index: Dict[Optional[str], List[Any]] = {}
+                for r in self.rows:
+                    value = getattr(r, column)
+                    index.setdefault(str(value) if value is not None else None, []).append(r)
+                self._index[column] = index
+            return self._index[column]
+
+    def select(self, start: datetime.date, end: datetime.date, filters: Tuple) -> List[Any]:
+        """
+        Rows matching a query this dataset covers
+        """
+        remaining = [f for f in filters if f not in self.filters]
+
+        rows = self.rows
+        # Narrow down by an ID first as rows are partitioned by them
+        for name, value in remaining:
+            if name in ID_FILTERS:
+                rows = self._partition(ID_FILTERS[name]).get(value, [])
+                remaining.remove((name, value))
+                break
+
+        checks: List[Callable[[Any], bool]] = []
+        for name, value in remaining:
+            if name in ID_FILTERS:
+                column = ID_FILTERS[name]
+                checks.append(
+                    lambda r, c=column, v=value: (str(getattr(r, c)) if getattr(r, c) is not None else None) == v
+                )
+            else:
+                column = NAME_FILTERS[name]
+                pattern = _ilike(value)
+                checks.append(
+                    lambda r, c=column, p=pattern: getattr(r, c) is not None and p.fullmatch(getattr(r, c)) is not None
+                )
+        if start > self.start or end < self.end:
+            checks.append(lambda r: start <= r.start.date() <= end)
+
+        if not checks:
+            return list(rows)
+        return [r for r in rows if all(check(r) for check in checks)]
+
+
+def _organization(organization_id) -> str:
+    # Organization IDs in the form the database returns them, so IDs given in upper case or braces still match
+    try:
+        return str(uuid.UUID(str(organization_id)))
+    except ValueError:
+        # Left for the database to reject
+        return str(organization_id)
+
+
+class DatasetCache(object):
+    """
+    Time entries and report data shared by the reports of a run
+
+    A query is answered from any cached dataset covering it, filtering its rows rather than querying the database
+    again. Member and client ID filters are left out of the queries that are made, so a step sending a report per
+    member or client fetches once and cuts each report from the same rows. Report data built from the same query is
+    kept too, so identical reports in later steps aren't aggregated again.
+    """
+
+    def __init__(self):
+        self._datasets: List[Dataset] = []
+        self._models: Dict[Tuple, Any] = {}
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+        self._fetching = SingleFlight()
+        # Organizations fetched together
+        self._batch: Set[str] = set()
+
+    def _find(self, organization_id: str, start: datetime.date, end: datetime.date, filters: Tuple) -> Optional[Dataset]:
+        # Cached dataset covering a query, if any
+        with self._lock:
+            for dataset in self._datasets:
+                if dataset.covers(organization_id, start, end, filters):
+                    return dataset
+        return None
+
+    def rows(self, db, organization_id: str, start: datetime.date, end: datetime.date, filters: Dict[str, Any]) -> List[Any]:
+        """
+        Time entries matching a query, fetching them only if no cached dataset covers it
+        :param filters: As for fetch()
+        """
+        key = normalize(filters)
+        organization_id = _organization(organization_id)
+        dataset = self._find(organization_id, start, end, key)
+        if dataset is None:
+            # Reports filtered by a member or client ID are usually one of many across the same period, so fetch the
+            # rows for all of them at once
+            broad = {k: v for k, v in filters.items() if k not in ID_FILTERS}
+            with self._lock:
+                # Likewise a run across several organizations fetches the period for all of them at once
+                organizations = (
+                    tuple(sorted(self._batch))
+                    if organization_id in self._batch and len(self._batch) > 1
+                    else (organization_id,)
+                )
+
+            # The query runs outside the lock so unrelated queries aren't held up. Reports making the same query at
+            # once wait for the first to fetch it
+            self._fetching.do(
+                (organizations, start, end, normalize(broad)),
+                lambda: self._fetch(db, organizations, organization_id, start, end, broad),
+            )
+            dataset = self._find(organization_id, start, end, key)
+
+        return dataset.select(start, end, key)
+
+    def _fetch(
+        self,
+        db,
+        organizations: Tuple[str, ...],
+        organization_id: str,
+        start: datetime.date,
+        end: datetime.date,
+        filters: Dict[str, Any],
+    ) -> None:
+        # Fetch rows for the organizations and cache a dataset for each
+        if self._find(organization_id, start, end, normalize(filters)) is not None:
+            # Fetched by another report since this one looked
+            return
+
+        if len(organizations) > 1:
+            # Rows of several organizations are partitioned by organization
+            rows: Dict[str, List[Any]] = {o: [] for o in organizations}
+            for r in fetch(db, list(organizations), start, end, filters):
+                rows[str(r.organization_id)].append(r)
+        else:
+            rows = {organization_id: fetch(db, organization_id, start, end, filters)}
+
+        with self._lock:
+            self._datasets.extend(
+                Dataset(o, start, end, normalize(filters), org_rows) for o, org_rows in rows.items()
+            )
+
+    def batch(self, organization_ids: List[str]) -> None:
+        """
+        Fetch the time entries of these organizations together. The first report of any of them needing a period
+        fetches that period for all of them in one query, and the reports of the others are then cut from its rows
+        """
+        with self._lock:
+            self._batch = {_organization(o) for o in organization_ids}
+
+    def model(self, key: Tuple, build: Callable[[], Any]) -> Any:
+        """
+        Report data for a key, building it if not already held
+        """
+        with self._lock:
+            if key in self._models:
+                return self._models[key]
+
+        # Reports asking for the same data at once wait for the first to build it
+        def build_and_keep():
+            model = build()
+            with self._lock:
+                self._models[key] = model
+            return model
+
+        return self._flight.do(key, build_and_keep)
@@ -0,0 +1,70 @@
+"""
+Export report data directly without converting to a PDF
+"""
+
+import csv
+from typing import Callable, Dict, Iterable, Any, List
+
+from pydantic import BaseModel
+
+# Formats reports can be generated in
+FORMATS = ("pdf", "html", "json", "csv", "xlsx")
+
+
+def write_json(data: BaseModel, output: str) -> None:
+    # Pydantic serializes the whole model to JSON in Rust
+    with open(output, "wb") as f:
+        f.write(data.model_dump_json(warnings=False).encode("utf-8"))
+
+
+def write_csv(rows: Iterable[Dict[str, Any]], fields: List[str], output: str) -> None:
+    # Rows are written as they are generated. The header is written even when there are no rows
+    with open(output, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+
+
+def write_xlsx(rows: Iterable[Dict[str, Any]], fields: List[str], output: str) -> None:
+    try:
+        from openpyxl import Workbook
+    except ImportError:
+        raise Exception("Exporting to xlsx needs openpyxl installed (pip install openpyxl)")
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(fields)
+    for row in rows:
+        sheet.append([row[k] for k in fields])
+    workbook.save(output)
+
+
+def export(
+    format: str,
+    data: BaseModel,
+    rows: Callable[[], Iterable[Dict[str, Any]]],
+    fields: List[str],
+    html: Callable[[], str],
+    output: str,
+) -> None:
+    """
+    Write report data to a file in a format other than PDF
+    :param format: One of FORMATS other than pdf
+    :param data: Report data
+    :param rows: Returns the report data flattened into rows for tabular formats
+    :param fields: Columns of the rows, in order
+    :param html: Returns the rendered report template
+    :param output: File to write
+    """
+    if format == "json":
+        write_json(data, output)
+    elif format == "csv":
+        write_csv(rows(), fields, output)
+    elif format == "xlsx":
+        write_xlsx(rows(), fields, output)
+    elif format == "html":
+        with open(output, "w") as f:
+            f.write(html())
+    else:
+        raise Exception("Unknown format '{}'".format(format))
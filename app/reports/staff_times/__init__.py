@@ -1 +1 @@
-from .staff_times import generate, report
+from .staff_times import generate, load, records, render, report
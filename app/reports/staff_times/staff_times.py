@@ -4,17 +4,17 @@ project
 """
 
 import datetime
-import tempfile
 from math import ceil, floor
 from pathlib import Path
-from typing import Dict
+from typing import Any, Dict, List, Tuple
 
 import click
-from gotenberg_client.options import PageMarginsType, Measurement, MeasurementUnitType
 from psycopg2 import Error
-from psycopg2.extras import NamedTupleCursor
 
 import systems
+from lib.converter import Resource
+from reports.dataset import DatasetCache, fetch, normalize
+from reports.export import FORMATS, export
 from .models import (
     DataModel,
     MemberDataModel,
@@ -27,9 +27,254 @@ from .models import (
 )
 
 
+# Columns of the rows the report is flattened into
+FIELDS = ["member", "date", "date_hours", "client", "project", "hours", "descriptions"]
+
+
+def rows(data: DataModel):
+    """
+    Flatten report data into a row for each project a member worked on each day
+    :param data: Report data
+    :return: Generator of rows
+    """
+    for _, member in sorted(data.members.items(), key=lambda m: m[1].name):
+        for _, date in sorted(member.dates.items()):
+            for _, client in sorted(date.clients.items(), key=lambda c: c[1].name):
+                for _, project in sorted(
+                    client.projects.items(), key=lambda p: p[1].name
+                ):
+                    yield {
+                        "member": member.name,
+                        "date": date.date.isoformat(),
+                        "date_hours": round(date.duration / 60 / 60, 2),
+                        "client": client.name,
+                        "project": project.name,
+                        "hours": round(project.duration / 60 / 60, 2),
+                        "descriptions": "; ".join(project.descriptions),
+                    }
+
+
+def aggregate(records, start: datetime.date, end: datetime.date) -> DataModel:
+    """
+    Build report data from time entries
+    :param records: Time entry rows
+    :param start: First day of period
+    :param end: Last day of period
+    :return: Report data
+    """
+    # Parse out time entries
+    data = DataModel(start=start, end=end)
+    for r in records:
+        if r.user_id not in data.members:
+            data.members[r.user_id] = MemberDataModel(name=r.user_name)
+        member_data = data.members[r.user_id]
+
+        start_date = r.start.date()
+
+        if start_date not in member_data.dates:
+            member_data.dates[start_date] = DateDataModel(date=start_date)
+        if start_date not in data.summary.dates:
+            data.summary.dates[start_date] = DateSummaryModel(date=start_date)
+        date_data = member_data.dates[start_date]
+
+        if r.client_id not in date_data.clients:
+            date_data.clients[r.client_id] = ClientDataModel(
+                name=r.client_name or "(No Client)"
+            )
+        client_data = date_data.clients[r.client_id]
+
+        if r.project_id not in client_data.projects:
+            client_data.projects[r.project_id] = ProjectDataModel(
+                name=r.project_name or "(No Project)"
+            )
+        project_data = client_data.projects[r.project_id]
+
+        if r.project_id not in data.summary.projects:
+            data.summary.projects[r.project_id] = ProjectSummaryModel(
+                name=r.project_name or "(No Project)",
+                client_name=r.client_name or "(No Client)",
+            )
+
+        duration = int((r.end - r.start).total_seconds())
+
+        project_data.time_entries.append(
+            TimeEntryDataModel(
+                start_time=r.start,
+                end_time=r.end,
+                duration=duration,
+                description=r.description,
+            )
+        )
+
+        # Add Non duplicated descriptions
+        if r.description not in project_data.descriptions:
+            project_data.descriptions.append(r.description)
+
+        project_data.duration += duration
+        client_data.duration += duration
+        date_data.duration += duration
+        member_data.duration += duration
+        data.duration += duration
+        data.summary.projects[r.project_id].duration += duration
+
+    # Perform rounding. Time over a day per member is rounded up to the nearest 30 minutes unless within 15% (4.5 minutes) of
+    # lower boundary in which case it rounds down unless it would round to 0.
+    data.duration = 0
+    for _, member_data in data.members.items():
+        member_data.duration = 0
+        for date, date_data in member_data.dates.items():
+            half_hours = date_data.duration / 60 / 30
+            delta = half_hours - floor(half_hours)
+            duration = (
+                (
+                    floor(half_hours)
+                    if delta < 0.15 and half_hours > 1
+                    else ceil(half_hours)
+                )
+                * 30
+                * 60
+            )
+
+            date_data.duration = duration
+            data.summary.dates[date].duration += duration
+            member_data.duration += duration
+            data.duration += duration
+
+    return data
+
+
+def _filters(project_filter, member_filter, member_id_filter, client_filter) -> Dict[str, Any]:
+    return {
+        "client": client_filter,
+        "project": project_filter,
+        "member": member_filter,
+        "member_id": member_id_filter,
+    }
+
+
+def records(
+    db,
+    organization_id,
+    start: datetime.date,
+    end: datetime.date,
+    project_filter="",
+    member_filter="",
+    member_id_filter=None,
+    client_filter="",
+    dataset: DatasetCache = None,
+) -> List[Any]:
+    """
+    Query the time entries the report is built from
+    :param dataset: Cache to share time entries through with other reports in the same run
+    :return: Time entry rows
+    """
+    filters = _filters(project_filter, member_filter, member_id_filter, client_filter)
+    if dataset is not None:
+        return dataset.rows(db, organization_id, start, end, filters)
+    return fetch(db, organization_id, start, end, filters)
+
+
+def load(
+    db,
+    organization_id,
+    start: datetime.date,
+    end: datetime.date,
+    project_filter="",
+    member_filter="",
+    member_id_filter=None,
+    client_filter="",
+    dataset: DatasetCache = None,
+) -> DataModel:
+    """
+    Query the time entries for the report and aggregate them
+    :param dataset: Cache to share time entries and report data through with other reports in the same run
+    :return: Report data
+    """
+    filters = _filters(project_filter, member_filter, member_id_filter, client_filter)
+
+    def build() -> DataModel:
+        return aggregate(
+            records(
+                db,
+                organization_id,
+                start,
+                end,
+                project_filter=project_filter,
+                member_filter=member_filter,
+                member_id_filter=member_id_filter,
+                client_filter=client_filter,
+                dataset=dataset,
+            ),
+            start,
+            end,
+        )
+
+    # Reports in the same run with the same query share their data
+    if dataset is not None:
+        return dataset.model(
+            ("staff_times", organization_id, start, end, normalize(filters)), build
+        )
+    return build()
+
+
+def render(
+    env,
+    converter,
+    data: DataModel,
+    resources: Dict[str, Resource],
+    template="staff_times",
+    footer_template="footer",
+) -> Tuple[List[str], str]:
+    """
+    Render the report to the HTML converted into its PDF
+    :param resources: Resources loaded by converter.resources()
+    :return: HTML of each part of the report and HTML of the footer
+    """
+    # Resources available to templates mapped to the url to refer to them by
+    resources_available = {k: r.url for k, r in resources.items()}
+    tmpl = env.get_template(template + ".html")
+    tmpl_footer = env.get_template(footer_template + ".html")
+
+    # Large reports are split into a summary part followed by parts each showing the detail for a chunk of members
+    chunks = converter.split(sorted(data.members, key=lambda k: data.members[k].name))
+    if len(chunks) > 1:
+        parts = [
+            tmpl.render(data=data, resources=resources_available, part="summary")
+        ] + [
+            tmpl.render(
+                data=data.model_copy(
+                    update={"members": {k: data.members[k] for k in chunk}}
+                ),
+                resources=resources_available,
+                part="detail",
+            )
+            for chunk in chunks
+        ]
+    else:
+        parts = [tmpl.render(data=data, resources=resources_available)]
+
+    return parts, tmpl_footer.render(data=data, resources=resources_available)
+
+
 @click.command("staff_times")
-@click.option("--output", help="Output file (Default: output.pdf)")
-@click.option("--organization-id", help="Organization UUID (Required)")
+@click.option("--output", help="Output file (Default: output.<format>)")
+@click.option(
+    "--format",
+    help="Output format. Formats other than pdf skip PDF conversion (Default: pdf)",
+    type=click.Choice(FORMATS),
+    default="pdf",
+)
+@click.option(
+    "--organization-id",
+    help="Organization UUID (Required). Can be passed multiple times to write a file for each organization",
+    multiple=True,
+)
+@click.option(
+    "--all-organizations",
+    help="Write a file for every organization",
+    default=False,
+    is_flag=True,
+)
 @click.option("--template", help="Which Template to use (Default:staff_times")
 @click.option(
     "--footer-template",
@@ -62,6 +307,7 @@ def generate(
     ctx,
     output,
     organization_id,
+    all_organizations,
     template,
     footer_template,
     start,
@@ -72,16 +318,16 @@ def generate(
     client_filter,
     resource,
     debug,
+    format,
 ):
     cfg = ctx.obj["config"]
     db = systems.database(cfg)
     env = systems.jinja(cfg)
-    gotenberg = systems.gotenberg(cfg)
+    converter = systems.converter(cfg)
 
     # Apply defaults
     args = {
         "output": output,
-        "organization_id": organization_id,
         "template": template,
         "footer_template": footer_template,
         "start": start.date() if start is not None else None,
@@ -94,15 +340,19 @@ def generate(
     defaults = {
         "start": datetime.date.today(),
         "end": datetime.date.today(),
-        "output": "output.pdf",
+        "output": "output.{}".format(format),
     }
     args = {
         k: v if v is not None else cfg.defaults.get(k, defaults.get(k))
         for k, v in args.items()
     }
+    # An output set in the config's defaults takes the extension of the format being written
+    if output is None and "output" in cfg.defaults:
+        args["output"] = str(Path(args["output"]).with_suffix("." + format))
 
     # Sanity Checks
-    if args.get("organization_id") is None:
+    organization_ids = systems.organizations(cfg, db, organization_id, all_organizations)
+    if not organization_ids:
         raise Exception("No organization_id specified")
 
     # Add resources if any passed
@@ -117,21 +367,43 @@ def generate(
     # Map output under sr-data
     args["output"] = str(cfg.sr_data.joinpath(args["output"]))
 
-    print(f"Generating {args['output']} from {args['start']} to {args['end']}")
+    def generate_for(organization_id, output, dataset=None):
+        print(f"Generating {output} from {args['start']} to {args['end']}")
+
+        report(
+            db,
+            env,
+            converter,
+            debug=debug,
+            format=format,
+            dataset=dataset,
+            **{
+                k: v
+                for k, v in {**args, "organization_id": organization_id, "output": output}.items()
+                if v is not None
+            },
+        )
+
+    if len(organization_ids) == 1:
+        generate_for(organization_ids[0], args["output"])
+        return
 
-    report(
-        db,
-        env,
-        gotenberg,
-        debug=debug,
-        **{k: v for k, v in args.items() if v is not None},
+    # Several organizations are written to a file each, fetching their time entries together in one query
+    dataset = DatasetCache()
+    dataset.batch(organization_ids)
+    failed = systems.for_each_organization(
+        cfg,
+        organization_ids,
+        lambda o: generate_for(o, systems.organization_output(args["output"], o), dataset),
     )
+    if failed:
+        raise Exception(f"Failed for {len(failed)} of {len(organization_ids)} organizations")
 
 
 def report(
     db,
     env,
-    gotenberg,
+    converter,
     output="output.pdf",
     organization_id=None,
     project_filter="",
@@ -144,157 +416,58 @@ def report(
     template="staff_times",
     resources: Dict[str, Path] = None,
     debug=False,
+    format="pdf",
+    dataset: DatasetCache = None,
 ):
+    """
+    Generate the report
+    :param output: File name or binary file object (such as io.BytesIO) to write the report to
+    :param dataset: Cache to share time entries and report data through with other reports in the same run
+    :return: Report data
+    """
     resources = resources or {}
     try:
-        with db.cursor(cursor_factory=NamedTupleCursor) as cursor:
-            sql = f"""
-                SELECT te.start, te.end, te.description, users.id as user_id, users.name as user_name,
-                     clients.id as client_id, clients.name as client_name, 
-                     projects.id as project_id, projects.name as project_name, projects.billable_rate as project_billable_rate,
-                     te.billable_rate, te.billable, organizations.billable_rate as organization_billable_rate
-                FROM users JOIN members ON (members.user_id = users.id)
-                     JOIN time_entries te ON (te.member_id = members.id)
-                     LEFT JOIN projects ON (te.project_id = projects.id)
-                     LEFT JOIN clients ON (te.client_id = clients.id)
-                     JOIN organizations ON (te.organization_id = organizations.id)
-                WHERE te.organization_id = %(organization_id)s
-                    AND te.start >= %(start)s
-                    AND te.start < %(end)s
-                    { "AND clients.name ilike %(client)s" if client_filter else "" }
-                    { "AND projects.name ilike %(project)s" if project_filter else "" }
-                    { "AND users.name ilike %(member)s" if member_filter else "" }
-                    { "AND users.id = %(member_id)s" if member_id_filter else "" }
-                  """
-
-            cursor.execute(
-                sql,
-                {
-                    "organization_id": organization_id,
-                    "start": start.isoformat(),
-                    "end": (end + datetime.timedelta(days=1)).isoformat(),
-                    "project": "%{}%".format(project_filter),
-                    "member": "%{}%".format(member_filter),
-                    "client": "%{}%".format(client_filter),
-                    "member_id": member_id_filter,
-                },
-            )
-            records = cursor.fetchall()
-
-    except (Exception, Error) as error:
+        data = load(
+            db,
+            organization_id,
+            start,
+            end,
+            project_filter=project_filter,
+            member_filter=member_filter,
+            member_id_filter=member_id_filter,
+            client_filter=client_filter,
+            dataset=dataset,
+        )
+    except Error as error:
         print("Error while connecting to PostgreSQL", error)
         return
-    finally:
-        cursor.close()
-
-    # Parse out time entries
-    data = DataModel(start=start, end=end)
-    for r in records:
-        if r.user_id not in data.members:
-            data.members[r.user_id] = MemberDataModel(name=r.user_name)
-        member_data = data.members[r.user_id]
-
-        start_date = r.start.date()
-
-        if start_date not in member_data.dates:
-            member_data.dates[start_date] = DateDataModel(date=start_date)
-        if start_date not in data.summary.dates:
-            data.summary.dates[start_date] = DateSummaryModel(date=start_date)
-        date_data = member_data.dates[start_date]
-
-        if r.client_id not in date_data.clients:
-            date_data.clients[r.client_id] = ClientDataModel(
-                name=r.client_name or "(No Client)"
-            )
-        client_data = date_data.clients[r.client_id]
-
-        if r.project_id not in client_data.projects:
-            client_data.projects[r.project_id] = ProjectDataModel(
-                name=r.project_name or "(No Project)"
-            )
-        project_data = client_data.projects[r.project_id]
-
-        if r.project_id not in data.summary.projects:
-            data.summary.projects[r.project_id] = ProjectSummaryModel(
-                name=r.project_name or "(No Project)",
-                client_name=r.client_name or "(No Client)",
-            )
 
-        duration = int((r.end - r.start).total_seconds())
+    tmpl = env.get_template(template + ".html")
 
-        project_data.time_entries.append(
-            TimeEntryDataModel(
-                start_time=r.start,
-                end_time=r.end,
-                duration=duration,
-                description=r.description,
-            )
+    if format != "pdf":
+        # Only the html export uses resources. It is opened on its own, so they are inlined into it
+        export(
+            format,
+            data,
+            lambda: rows(data),
+            FIELDS,
+            lambda: tmpl.render(
+                data=data,
+                resources={k: r.url for k, r in converter.resources(resources, inline=True).items()},
+            ),
+            output,
         )
+        return data
 
-        # Add Non duplicated descriptions
-        if r.description not in project_data.descriptions:
-            project_data.descriptions.append(r.description)
-
-        project_data.duration += duration
-        client_data.duration += duration
-        date_data.duration += duration
-        member_data.duration += duration
-        data.duration += duration
-        data.summary.projects[r.project_id].duration += duration
-
-    # Perform rounding. Time over a day per member is rounded up to the nearest 30 minutes unless within 15% (4.5 minutes) of
-    # lower boundary in which case it rounds down unless it would round to 0.
-    data.duration = 0
-    for _, member_data in data.members.items():
-        member_data.duration = 0
-        for date, date_data in member_data.dates.items():
-            half_hours = date_data.duration / 60 / 30
-            delta = half_hours - floor(half_hours)
-            duration = (
-                (
-                    floor(half_hours)
-                    if delta < 0.15 and half_hours > 1
-                    else ceil(half_hours)
-                )
-                * 30
-                * 60
-            )
-
-            date_data.duration = duration
-            data.summary.dates[date].duration += duration
-            member_data.duration += duration
-            data.duration += duration
+    # Resources available to templates mapped to the url to refer to them by
+    resources = converter.resources(resources)
+    resources_available = {k: r.url for k, r in resources.items()}
 
-    resources_available = [k for k, _ in resources.items()]
-    tmpl = env.get_template(template + ".html")
-    if debug:
+    if debug and isinstance(output, (str, Path)):
         with open("{}-debug.html".format(output), "w") as f:
             f.write(tmpl.render(data=data, resources=resources_available))
-    with tempfile.NamedTemporaryFile() as tmp:
-        tmpl_footer = env.get_template(footer_template + ".html")
-        tmp.write(
-            tmpl_footer.render(data=data, resources=resources_available).encode("utf-8")
-        )
-        tmp.flush()
-
-        with gotenberg() as client:
-            with client.chromium.html_to_pdf() as route:
-                builder = (
-                    route.string_index(
-                        tmpl.render(data=data, resources=resources_available)
-                    )
-                    .margins(
-                        PageMarginsType(
-                            bottom=Measurement(100, MeasurementUnitType.Pixels)
-                        )
-                    )
-                    .footer(Path(tmp.name))
-                )
-
-                for name, path in resources.items():
-                    builder.resource(path, name=name)
 
-                response = builder.run()
-                response.to_file(Path(output))
+    parts, footer = render(env, converter, data, resources, template, footer_template)
+    converter.convert(parts, footer, output, resources=resources)
 
     return data
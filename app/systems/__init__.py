@@ -1,4 +1,7 @@
+from .converter import converter
 from .database import database
 from .email import email
 from .gotenberg import gotenberg
 from .jinja import jinja
+from .services import Services
+from .organizations import for_each_organization, organization_output, organizations
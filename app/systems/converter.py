@@ -0,0 +1,33 @@
+from lib import converter as converter_lib
+from models.config import Config
+from .gotenberg import gotenberg
+
+
+def converter(cfg: Config, gotenberg_client=None):
+    # Setup PDF Converter using the configured renderer and an optional cache of rendered PDFs
+    if cfg.renderer == "weasyprint":
+        renderer = converter_lib.WeasyPrintRenderer()
+    else:
+        renderer = converter_lib.GotenbergRenderer(gotenberg(cfg, gotenberg_client))
+
+    cache = None
+    if cfg.cache.enabled:
+        cache = converter_lib.Cache(
+            cfg.sr_data.joinpath(".cache"),
+            size_limit=(
+                cfg.cache.size_limit * 1024 * 1024
+                if cfg.cache.size_limit is not None
+                else None
+            ),
+        )
+
+    return converter_lib.Converter(
+        renderer,
+        cache=cache,
+        resource_manager=converter_lib.ResourceManager(
+            inline_max_size=cfg.resources.inline_max_size,
+            image_max_size=cfg.resources.image_max_size,
+        ),
+        chunk_size=cfg.chunk.size,
+        workers=cfg.chunk.workers,
+    )
@@ -15,6 +15,18 @@ def email(cfg: Config):
         password=cfg.email.password,
         from_name=cfg.email.from_name,
         from_email=cfg.email.from_email,
+        max_messages_per_connection=cfg.email.max_messages_per_connection,
+        precompile_templates=cfg.email.precompile_templates,
+        template_cache=cfg.sr_data.joinpath(".cache/email"),
+        dispatch_workers=cfg.email.workers,
+        messages_per_second=cfg.email.messages_per_second,
+        retries=cfg.email.retries,
+        retry_backoff=cfg.email.retry_backoff,
+        outbox=(
+            emailclient.Outbox(cfg.sr_data.joinpath("outbox"))
+            if cfg.email.outbox
+            else None
+        ),
         templates=[
             cfg.sr_data.joinpath("templates/email"),
             Path(os.path.dirname(os.path.realpath(__file__))).joinpath(
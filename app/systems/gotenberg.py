@@ -5,10 +5,11 @@ from gotenberg_client import GotenbergClient
 from models.config import Config
 
 
-def gotenberg(cfg: Config):
+def gotenberg(cfg: Config, client: GotenbergClient | None = None):
+    # Each use gets a new client unless a client to share is given
 
     @contextlib.contextmanager
     def wrapper():
-        yield GotenbergClient(cfg.gotenberg.uri)
+        yield client if client is not None else GotenbergClient(cfg.gotenberg.uri)
 
     return wrapper
\ No newline at end of file
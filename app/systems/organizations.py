@@ -0,0 +1,67 @@
+import sys
+from contextlib import nullcontext, redirect_stdout
+from pathlib import Path
+from typing import Callable, Dict, List, Sequence
+
+from lib.steps import GroupedOutput, Step, run_steps
+from models.config import Config
+
+
+def organizations(cfg: Config, db, organization_ids: Sequence[str], all_organizations: bool) -> List[str]:
+    """
+    Organizations a run is for
+    :param organization_ids: Organizations asked for, if any. Falls back to the default organization_id
+    :param all_organizations: Run for every organization in the database instead
+    :return: Organization IDs, in the order to work on them
+    """
+    if all_organizations:
+        with db.cursor() as cursor:
+            cursor.execute("SELECT id FROM organizations ORDER BY name")
+            return [str(r[0]) for r in cursor.fetchall()]
+
+    if organization_ids:
+        # Drop repeats while keeping the order given
+        return list(dict.fromkeys(str(o) for o in organization_ids))
+
+    if cfg.defaults.get("organization_id") is not None:
+        return [str(cfg.defaults["organization_id"])]
+    return []
+
+
+def organization_output(output: str, organization_id: str) -> str:
+    """
+    Output file of one organization when a run writes a file per organization. {organization_id} in the name is
+    replaced by the organization, otherwise the organization is added before the extension
+    """
+    if "{organization_id}" in output:
+        return output.replace("{organization_id}", organization_id)
+    path = Path(output)
+    return str(path.with_name(f"{path.stem}-{organization_id}{path.suffix}"))
+
+
+def for_each_organization(
+    cfg: Config, organization_ids: List[str], run: Callable[[str], None]
+) -> Dict[str, Exception]:
+    """
+    Run something for each organization, working on up to organizations.workers of them at once
+    :param run: Called with each organization ID
+    :return: Error of each organization that failed, by ID
+    """
+    workers = min(cfg.organizations.workers, len(organization_ids))
+    # When organizations are worked on at once the output of each is held back and printed together once it finishes
+    output = GroupedOutput(sys.stdout) if workers > 1 else None
+
+    def each(organization_id: str) -> None:
+        with output.capture() if output is not None else nullcontext():
+            try:
+                run(organization_id)
+            except Exception as e:
+                print(f"Failed for organization {organization_id}: {e}")
+                raise
+
+    steps = [Step(o, [], lambda o=o: each(o)) for o in organization_ids]
+    if output is None:
+        return run_steps(steps)
+    with redirect_stdout(output):
+        return run_steps(steps, workers=workers)
+
@@ -0,0 +1,123 @@
+import threading
+from typing import Any, Callable, Dict
+
+from models.config import Config
+from .converter import converter
+from .database import database
+from .email import email
+from .jinja import jinja
+
+
+class Services(object):
+    """
+    Services shared by everything in a run
+
+    Each service is created the first time it is used, so a run only connects to what it needs, and everything is
+    closed together when the run ends.
+    """
+
+    def __init__(self, cfg: Config):
+        self.cfg = cfg
+        self._services: Dict[str, Any] = {}
+        self._lock = threading.RLock()
+
+    def _get(self, name: str, factory: Callable[[], Any]) -> Any:
+        with self._lock:
+            if name not in self._services:
+                self._services[name] = factory()
+            return self._services[name]
+
+    @property
+    def db(self):
+        return self._get("db", lambda: database(self.cfg))
+
+    @property
+    def jinja(self):
+        return self._get("jinja", lambda: jinja(self.cfg))
+
+    @property
+    def gotenberg_client(self):
+        # Imported here so runs rendering with weasyprint don't need gotenberg_client
+        from gotenberg_client import GotenbergClient
+
+        return self._get("gotenberg_client", lambda: GotenbergClient(self.cfg.gotenberg.uri))
+
+    @property
+    def converter(self):
+        return self._get(
+            "converter",
+            lambda: converter(
+                self.cfg,
+                gotenberg_client=(
+                    self.gotenberg_client if self.cfg.renderer == "gotenberg" else None
+                ),
+            ),
+        )
+
+    @property
+    def email(self):
+        return self._get("email", lambda: email(self.cfg))
+
+    @property
+    def datasets(self):
+        # Imported here as reports import systems
+        from reports.dataset import DatasetCache
+
+        return self._get("datasets", DatasetCache)
+
+    @property
+    def coalescer(self):
+        # Imported here as reports import systems
+        from reports.coalesce import Coalescer
+
+        return self._get("coalescer", Coalescer)
+
+    def reset(self) -> None:
+        """
+        Ready long-lived services for another run. The database transaction is ended so the next run sees new time
+        entries, a dropped database connection is replaced and the time entries cached by the last run are forgotten
+        """
+        with self._lock:
+            self._services.pop("datasets", None)
+
+            db = self._services.get("db")
+            if db is not None:
+                try:
+                    db.rollback()
+                except Exception as e:
+                    print(f"Reconnecting to the database: {e}")
+                    self._services.pop("db")
+                    try:
+                        db.close()
+                    except Exception:
+                        pass
+
+    def drain_email(self) -> None:
+        """
+        Wait for emails still queued to be sent, if any were. Their callbacks may still need other services
+        """
+        with self._lock:
+            email = self._services.get("email")
+        if email is not None:
+            for to, error in email.drain():
+                print("Failed sending email to {}: {}".format(", ".join(to), error))
+
+    def close(self) -> None:
+        """
+        Close every service that was created, sending any emails still queued first
+        """
+        with self._lock:
+            services, self._services = self._services, {}
+
+        for name in ("email", "gotenberg_client", "db"):
+            if name in services:
+                try:
+                    services[name].close()
+                except Exception as e:
+                    print(f"Error closing {name}: {e}")
+
+    def __enter__(self) -> "Services":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()